@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Compare the speed of the engines used to find functions on large generated files.
+
+Run from the repository root with ``python benchmarks/bench_engines.py``.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from check_docstrings import ENGINES, check_source  # noqa: E402
+from corpus import generate_source  # noqa: E402
+
+
+def main() -> None:
+    """Time finding and checking functions with each engine."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--functions", type=int, nargs="+", default=[1000, 10000, 50000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'functions':>10} {'engine':>8} {'find (s)':>10} {'check (s)':>10}")
+    for num_functions in args.functions:
+        code = generate_source(num_functions)
+        for name, find_functions in sorted(ENGINES.items()):
+            find = min(
+                timeit.repeat(
+                    lambda: list(find_functions(code)), number=1, repeat=args.repeat
+                )
+            )
+            check = min(
+                timeit.repeat(
+                    lambda: check_source(code, "bench.py", name),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            print(f"{num_functions:>10} {name:>8} {find:>10.3f} {check:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Generate synthetic Python sources and corpora of files for the benchmarks."""
+import os
+
+FUNCTION = '''
+def function_{i}(arg1: int, arg2: str, arg3: float = 1.0) -> None:
+    """
+    Function number {i}.
+
+    Args:
+        arg1 (int): Integer.
+        arg2 (str): String.
+        arg3 (float): Float.
+    """
+    return
+'''
+
+
+def generate_source(num_functions: int) -> str:
+    """Generate a module with num_functions documented functions."""
+    return "".join(FUNCTION.format(i=i) for i in range(num_functions))
+
+
+def nested_type(depth: int) -> str:
+    """Return a type hint nested depth levels deep, e.g. dict[str, list[int]]."""
+    hint = "int"
+    for level in range(depth):
+        hint = f"dict[str, list[{hint}]]" if level % 2 else f"tuple[{hint}, str]"
+    return hint
+
+
+def generate_nested_signatures(num_functions: int, depth: int) -> str:
+    """Generate functions whose arguments have deeply nested type hints."""
+    functions = []
+    hint = nested_type(depth)
+    for i in range(num_functions):
+        functions.append(
+            f"def nested_{i}(a: {hint}, b: {hint} = None) -> None:\n"
+            '    """\n'
+            "    Nested type hints.\n"
+            "\n"
+            "    Args:\n"
+            f"        a ({hint}): First.\n"
+            f"        b ({hint}): Second.\n"
+            '    """\n'
+        )
+    return "\n".join(functions)
+
+
+def long_docstring(num_args: int, description_lines: int) -> str:
+    """Return a docstring with num_args args that each have a long description."""
+    lines = ["", "    Many arguments.", "", "    Args:"]
+    for i in range(num_args):
+        lines.append(f"        arg{i} (int): Argument {i}.")
+        more = f"            More about argument {i}."
+        lines.extend(more for _ in range(description_lines))
+    return "\n".join(lines) + "\n    "
+
+
+def generate_long_docstrings(num_functions: int, num_args: int) -> str:
+    """Generate functions with many arguments and long docstrings."""
+    args = ", ".join(f"arg{i}: int" for i in range(num_args))
+    docstring = long_docstring(num_args, 5)
+    return "\n".join(
+        f'def long_{i}({args}) -> None:\n    """{docstring}"""\n'
+        for i in range(num_functions)
+    )
+
+
+def generate_pathological(size: int) -> str:
+    """Generate inputs that make a backtracking regex take quadratic time."""
+    return (
+        "def blank_lines(a: int):" + "\n" * size + "x = 1\n"
+        "def unclosed(" + "def g(" * size + ")\n"
+        "def arrows() -> " + "a) -> " * size + ":\n"
+    )
+
+
+def write_corpus(directory: str, sources: dict) -> list:
+    """Write each source to directory under its file name and return the paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, source in sources.items():
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf8") as file:
+            file.write(source)
+        paths.append(path)
+    return paths
+
+
+def generate_corpora(directory: str, scale: float = 1.0) -> dict:
+    """
+    Write the benchmark corpora to subdirectories of directory.
+
+    Args:
+        directory (str): Directory to write the corpora into.
+        scale (float): Multiplier for the number and size of the generated files.
+
+    Returns:
+        dict: Paths of the files in each corpus, keyed by corpus name.
+    """
+
+    def n(count: int) -> int:
+        return max(1, int(count * scale))
+
+    corpora = {
+        "many_small_files": {
+            f"small_{i}.py": generate_source(5) for i in range(n(1000))
+        },
+        "huge_files": {f"huge_{i}.py": generate_source(n(20000)) for i in range(3)},
+        "nested_signatures": {"nested.py": generate_nested_signatures(n(2000), 8)},
+        "long_docstrings": {"long.py": generate_long_docstrings(n(500), 50)},
+        "pathological": {"pathological.py": generate_pathological(n(20000))},
+    }
+    return {
+        name: write_corpus(os.path.join(directory, name), sources)
+        for name, sources in corpora.items()
+    }
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""Time check_docstrings on synthetic corpora and compare results across commits.
+
+Run from the repository root, e.g.::
+
+    python benchmarks/run_benchmarks.py --output before.json
+    # ...make changes...
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+
+Each benchmark is run --repeat times and the minimum, median and maximum wall time in
+seconds are recorded. With --compare, benchmarks that got slower by more than
+--threshold are listed and the exit code is 1. So are benchmarks with a latency target
+in TARGETS whose median misses it.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import check_docstrings  # noqa: E402
+import check_docstrings_lsp  # noqa: E402
+from corpus import (  # noqa: E402
+    generate_corpora,
+    generate_source,
+    long_docstring,
+    nested_type,
+)
+
+# Median seconds a benchmark must take less than, for interactive use
+TARGETS = {
+    "lsp/open/2000_functions": 0.5,
+    "lsp/edit/2000_functions": 0.05,
+    # Including the interpreter's own startup
+    "startup/import": 0.1,
+    "startup/cli": 0.15,
+}
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_main(argv: list) -> None:
+    """Run check_docstrings.main, ignoring the exit it always ends with."""
+    try:
+        check_docstrings.main(argv)
+    except SystemExit:
+        pass
+
+
+def lsp_benchmarks(num_functions: int) -> dict:
+    """Return benchmarks of the language server opening and editing a document."""
+    text = generate_source(num_functions)
+    open_params = {
+        "textDocument": {"uri": "file:///bench.py", "version": 1, "text": text}
+    }
+
+    def open_document() -> None:
+        server = check_docstrings_lsp.LanguageServer(io.BytesIO())
+        server.did_open(open_params)
+        return server
+
+    # Type in and delete a character in the docstring of a function in the middle
+    server = open_document()
+    line = text.count("\n", 0, text.index('"""', len(text) // 2)) + 1
+    insert = {"range": {"start": {"line": line, "character": 0}}, "text": "x"}
+    insert["range"]["end"] = insert["range"]["start"]
+    delete = {"range": {"start": insert["range"]["start"]}, "text": ""}
+    delete["range"]["end"] = {"line": line, "character": 1}
+    edits = itertools.cycle([insert, delete])
+
+    def edit() -> None:
+        change = {"textDocument": {"uri": "file:///bench.py"}}
+        server.did_change({**change, "contentChanges": [next(edits)]})
+
+    return {
+        f"lsp/open/{num_functions}_functions": open_document,
+        f"lsp/edit/{num_functions}_functions": edit,
+    }
+
+
+def startup_benchmarks(path: str) -> dict:
+    """Return benchmarks of starting a new process to check a small file."""
+    library = "import check_docstrings; check_docstrings.check_source('')"
+    cli = [sys.executable, "-m", "check_docstrings", "--no-cache", "--jobs", "1"]
+    commands = {
+        "startup/import": [sys.executable, "-c", library],
+        "startup/cli": [*cli, path],
+    }
+    return {
+        name: lambda command=command: subprocess.run(command, cwd=REPO, check=False)
+        for name, command in commands.items()
+    }
+
+
+def benchmarks(corpora: dict) -> dict:
+    """Return the benchmarks to run as functions keyed by name."""
+    cases = {}
+    for name, paths in corpora.items():
+        cases[f"main/{name}/jobs=1"] = lambda paths=paths: run_main(
+            ["--no-cache", "--jobs", "1", *paths]
+        )
+        cases[f"main/{name}/jobs=auto"] = lambda paths=paths: run_main(
+            ["--no-cache", *paths]
+        )
+        for engine in sorted(check_docstrings.ENGINES):
+            if name == "pathological" and engine == "regex":
+                continue  # Takes minutes, which is why the scan engine exists
+            cases[f"check_docstrings/{name}/{engine}"] = (
+                lambda paths=paths, engine=engine: [
+                    check_docstrings.check_docstrings(path, engine) for path in paths
+                ]
+            )
+
+    # The parsers themselves, without the memos that would make repeats free
+    parse_docstring = check_docstrings.parse_google_docstring.function
+    get_type_hints = check_docstrings.get_type_hints_from_args.function
+    docstring = long_docstring(200, 3)
+    cases["parse_google_docstring/200_args"] = lambda: [
+        parse_docstring(docstring) for _ in range(100)
+    ]
+    args = [f"arg{i}:int={i}" for i in range(200)]
+    cases["get_type_hints_from_args/200_args"] = lambda: [
+        get_type_hints(args) for _ in range(100)
+    ]
+    nested = [f"arg{i}:{nested_type(8).replace(' ', '')}" for i in range(20)]
+    cases["get_type_hints_from_args/nested"] = lambda: [
+        get_type_hints(nested) for _ in range(100)
+    ]
+    cases.update(lsp_benchmarks(2000))
+    cases.update(startup_benchmarks(corpora["many_small_files"][0]))
+    return cases
+
+
+def time_case(function: Callable, repeat: int) -> dict:
+    """Time function repeat times with its output discarded."""
+    times = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            # Each repeat starts with nothing remembered from the last
+            for memo in check_docstrings.MEMOS:
+                memo.clear()
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "max": max(times),
+        "repeat": repeat,
+    }
+
+
+def git_commit() -> str | None:
+    """Return the commit being benchmarked, if running in a git checkout."""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Return (name, old, new) for benchmarks slower than baseline by over threshold."""
+    regressions = []
+    for name, timing in results["benchmarks"].items():
+        old = baseline["benchmarks"].get(name)
+        if old is not None and timing["min"] > old["min"] * (1 + threshold):
+            regressions.append((name, old["min"], timing["min"]))
+    return regressions
+
+
+def main() -> int:
+    """Run the benchmarks and print or save the results as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="Corpus size factor")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--filter", default="", help="Only run benchmarks whose name contains this"
+    )
+    parser.add_argument("--output", help="File to write the JSON results to")
+    parser.add_argument(
+        "--compare", metavar="BASELINE", help="JSON results to compare to"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Allowed slowdown (default: 0.1)"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpora = generate_corpora(directory, args.scale)
+        cases = benchmarks(corpora)
+        timings = {}
+        for name, function in cases.items():
+            if args.filter in name:
+                timings[name] = time_case(function, args.repeat)
+                if name in TARGETS:
+                    timings[name]["target"] = TARGETS[name]
+                print(f"{name:<50} {timings[name]['min']:>10.4f}s", file=sys.stderr)
+
+    results = {
+        "commit": git_commit(),
+        "version": check_docstrings.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scale": args.scale,
+        "benchmarks": timings,
+    }
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    failed = False
+    for name, timing in timings.items():
+        if timing["median"] >= timing.get("target", float("inf")):
+            median, target = timing["median"], timing["target"]
+            print(f"Missed target: {name} {median:.4f}s >= {target}s", file=sys.stderr)
+            failed = True
+    if args.compare:
+        with open(args.compare, encoding="utf8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        for name, old, new in regressions:
+            print(f"Slower: {name} {old:.4f}s -> {new:.4f}s", file=sys.stderr)
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -4,32 +4,325 @@
 Check for consistency between the argument typehints in a function and what the arguments and
 typehints given in the function docstring. See README.md for more.
 """
-import argparse
-from typing import Sequence
+import ast
+import bisect
+import codecs
+import collections
+import contextlib
+import fnmatch
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import mmap
+import os
+import time
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, NamedTuple, Sequence
 import re
+import select
+import struct
 import sys
 
+# Modules that only some runs need, such as argparse for the command line or
+# concurrent.futures for worker processes, are imported where they are used, so
+# importing this module to check a few files stays fast
+if TYPE_CHECKING:
+    import argparse
+    import sqlite3
+    from concurrent.futures import ProcessPoolExecutor
 
+__version__ = "0.4.0"
+
+# Directory caches were kept in, in the checked tree, before they moved to
+# default_cache_dir()
+OLD_CACHE_DIR = ".check_docstrings_cache"
+CACHE_FILENAME = "cache.sqlite3"
+# Least recently used results are evicted at the end of a run once they take more
+DEFAULT_CACHE_MAX_SIZE = 256 << 20
+# How long to wait for another process writing to the cache database
+CACHE_BUSY_SECONDS = 30.0
+# Results record when they were last used to this precision, so a run over files
+# checked recently only reads the cache
+CACHE_TOUCH_SECONDS = 3600
+DEFAULT_TIMEOUT = 30.0
+# The daemon checks runs of up to this many files in-process, where cached results
+# stay in memory, and sends bigger runs to its worker processes
+DAEMON_INPROCESS_FILES = 32
+MEMORY_CACHE_ENTRIES = 100_000
+# Files of at least this many bytes have the verdicts for their functions cached too,
+# so when they change only the functions that changed are checked again. For smaller
+# files writing the verdicts costs more than checking every function again.
+VERDICTS_MIN_SIZE = 32 << 10
+# Files modified this recently when checked aren't added to the stat index, as a
+# change within the same tick of a coarse filesystem clock wouldn't show in the stat
+RACY_NANOSECONDS = 2_000_000_000
+# Runs over given files look their stat index rows up this many files at a time
+STAT_BATCH_FILES = 256
+# Budgets for remembering parsed docstrings and signatures, which often repeat
+DOCSTRING_MEMO_BYTES = 16 << 20
+ARGS_MEMO_BYTES = 8 << 20
+# With the scan engine, files of at least this many bytes are memory-mapped and
+# searched as bytes instead of being read and decoded whole
+MMAP_MIN_SIZE = 8 << 20
+# Memory-mapped files are checked to be UTF-8 in chunks of this many bytes
+UTF8_CHECK_CHUNK = 1 << 20
+# --watch waits for this long without changes before checking what changed, and polls
+# this often if inotify isn't available
+DEBOUNCE_SECONDS = 0.05
+POLL_SECONDS = 0.25
+# Output is written in chunks of about this many characters
+OUTPUT_BUFFER_SIZE = 65536
+# Verbosity levels: -v prints each function checked, -vv also checks that are skipped
+PROGRESS = 1
+DETAIL = 2
+DEFAULT_INCLUDE = ("*.py",)
+DEFAULT_EXCLUDE = (".git", ".hg", ".svn", "__pycache__", OLD_CACHE_DIR)
+
+# Regular expressions, compiled once at import instead of on every call
+PATTERNS = {
+    "whitespace": re.compile(r"\s+"),
+    "args section": re.compile(r"Args:(.*?)(?:\n\n|\Z)", re.DOTALL),
+    "docstring arg": re.compile(r"\s*([a-zA-Z0-9_]+) \(([^)]+)\)\s*:\s*([^\n\r]+)"),
+    "function": re.compile(
+        r"def (\w+)\(([^)]*)\)(?:\s|\n)*(?:->[^:]+)?:[\r\n]+\s*\"\"\"([^\"]*?)\"\"\"",
+        re.DOTALL,
+    ),
+    "hunk header": re.compile(r"@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@"),
+}
+
+
+def approximate_size(value: object) -> int:
+    """Return roughly how many bytes value takes, with the items of a dict or tuple."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    elif isinstance(value, tuple):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class LruMemo:
+    """
+    Remember the results of a function of one argument, within a budget of bytes.
+
+    Like functools.lru_cache, but bounded by the approximate size of the arguments and
+    results rather than their number, as a docstring can be a line or pages long. The
+    least recently used results are evicted to stay within the budget. Hits, misses
+    and evictions are counted for --profile. Results are shared between callers, so
+    they must not be modified.
+    """
+
+    def __init__(
+        self, function: Callable, max_bytes: int, key: Callable | None = None
+    ) -> None:
+        functools.update_wrapper(self, function)
+        self.function = function
+        self.max_bytes = max_bytes
+        self.key = key
+        self.entries = collections.OrderedDict()  # Key -> (result, size)
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __call__(self, arg: object) -> object:
+        key = arg if self.key is None else self.key(arg)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        result = self.function(arg)
+        size = approximate_size(key) + approximate_size(result)
+        if size <= self.max_bytes:
+            self.entries[key] = (result, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+        return result
+
+    def counts(self) -> dict[str, int]:
+        """Return the hits, misses and evictions so far, for Profile.counts."""
+        name = self.__name__
+        return {
+            f"{name} hits": self.hits,
+            f"{name} misses": self.misses,
+            f"{name} evictions": self.evictions,
+        }
+
+    def clear(self) -> None:
+        """Forget all results and reset the counts."""
+        self.entries.clear()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+
+
+def lru_memo(max_bytes: int, key: Callable | None = None) -> Callable:
+    """
+    Decorate a function of one argument to remember its results in an LruMemo.
+
+    Args:
+        max_bytes (int): Budget for the approximate size of the arguments and results.
+        key (Callable | None): Makes the argument hashable, e.g. tuple for a list.
+
+    Returns:
+        Callable: Decorator returning the LruMemo for a function.
+    """
+    return functools.partial(LruMemo, max_bytes=max_bytes, key=key)
+
+
+def split_top_level(text: str, separator: str) -> list:
+    """Split text on separator, ignoring separators nested inside brackets."""
+    parts = []
+    depth = start = 0
+    for i, char in enumerate(text):
+        if char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+@lru_memo(ARGS_MEMO_BYTES, key=tuple)
 def get_type_hints_from_args(list_of_args: list) -> dict:
     """Extract type hints from a list of function arguments."""
     type_hints = {}
     for param in list_of_args:
-        arg, type_hint = param.split(":")
-        type_hints[arg] = re.match(r"([\w|\[\]]+)=?", type_hint).group(1)
+        arg, _, type_hint = param.partition(":")
+        # Drop any default value
+        type_hints[arg] = split_top_level(type_hint, "=")[0]
     return type_hints
 
 
+# typing aliases for builtins (PEP 585) and other spellings of the same type
+TYPE_ALIASES = {
+    "List": "list",
+    "Dict": "dict",
+    "Set": "set",
+    "FrozenSet": "frozenset",
+    "Tuple": "tuple",
+    "Type": "type",
+    "Text": "str",
+    "NoneType": "None",
+}
+TYPE_MODULES = ("typing.", "typing_extensions.", "collections.abc.", "builtins.")
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_type_hint(type_hint: str) -> str:
+    """
+    Return a canonical spelling of a type hint, so equivalent hints compare equal.
+
+    Whitespace, typing module prefixes and the typing aliases of builtins are dropped,
+    and Optional[X], Union[X, Y] and X | Y all become unions with sorted members, e.g.
+    "typing.Optional[Dict[str, int]]" and "None | dict[str,int]" both become
+    "dict[str, int] | None". Hints that aren't valid expressions are returned with
+    whitespace removed. The same few hundred hints repeat across a codebase, so the
+    results are memoized.
+
+    Args:
+        type_hint (str): Type hint as written in a signature or docstring.
+
+    Returns:
+        str: Canonical spelling of the type hint.
+    """
+    try:
+        expression = ast.parse(type_hint.strip(), mode="eval").body
+        return format_type_node(expression)
+    except (SyntaxError, ValueError, RecursionError):
+        return PATTERNS["whitespace"].sub("", type_hint)
+
+
+def union_members(node: ast.expr) -> list[ast.expr]:
+    """Return the flattened members if node is a union of types, or an empty list."""
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+        members = [node.left, node.right]
+    elif isinstance(node, ast.Subscript):
+        name = format_type_node(node.value)
+        members = subscript_elements(node)
+        if name == "Optional" and len(members) == 1:
+            members = [members[0], ast.Constant(None)]
+        elif name != "Union":
+            return []
+    else:
+        return []
+    return [leaf for member in members for leaf in union_members(member) or [member]]
+
+
+def subscript_elements(node: ast.Subscript) -> list[ast.expr]:
+    """Return the elements inside the brackets of a subscript."""
+    return node.slice.elts if isinstance(node.slice, ast.Tuple) else [node.slice]
+
+
+def format_type_node(node: ast.expr) -> str:
+    """
+    Format a type hint expression in canonical form; see normalize_type_hint.
+
+    Args:
+        node (ast.expr): Parsed type hint.
+
+    Returns:
+        str: Canonical spelling of the type hint.
+
+    Raises:
+        ValueError: If node is not something that can appear in a type hint.
+    """
+    members = union_members(node)
+    if members:
+        formatted = {format_type_node(member) for member in members}
+        # Put None last, as it is usually written
+        has_none = "None" in formatted
+        formatted.discard("None")
+        return " | ".join(sorted(formatted) + ["None"] * has_none)
+    if isinstance(node, (ast.Name, ast.Attribute)):
+        name = ast.unparse(node)
+        for module in TYPE_MODULES:
+            if name.startswith(module):
+                name = name[len(module) :]
+                break
+        return TYPE_ALIASES.get(name, name)
+    if isinstance(node, ast.Constant):
+        if node.value is None or node.value is Ellipsis:
+            return str(node.value).replace("Ellipsis", "...")
+        if isinstance(node.value, str):
+            # A forward reference
+            return normalize_type_hint(node.value)
+        return repr(node.value)
+    if isinstance(node, ast.Subscript):
+        name = format_type_node(node.value)
+        elements = subscript_elements(node)
+        if name == "Literal":
+            # Literal values are values, not forward references
+            arguments = ", ".join(ast.unparse(element) for element in elements)
+        else:
+            arguments = ", ".join(format_type_node(element) for element in elements)
+        return f"{name}[{arguments}]"
+    if isinstance(node, (ast.List, ast.Tuple)):
+        elements = ", ".join(format_type_node(element) for element in node.elts)
+        return f"[{elements}]" if isinstance(node, ast.List) else f"({elements})"
+    raise ValueError(f"not a type hint: {ast.unparse(node)}")
+
+
+@lru_memo(DOCSTRING_MEMO_BYTES)
 def parse_google_docstring(docstring: str) -> dict:
     """Parse Google-style docstring to extract argument names and type."""
     # Extract the "Args:" section from the docstring
-    args_section_match = re.search(r"Args:(.*?)(?:\n\n|\Z)", docstring, re.DOTALL)
+    args_section_match = PATTERNS["args section"].search(docstring)
 
     if args_section_match:
         args_section = args_section_match.group(1).strip()
         # Parse the "Args:" section to extract argument names and types
         docstring_type_hints = {}
+        arg_pattern = PATTERNS["docstring arg"]
         for line in args_section.split("\n"):
-            match = re.match(r"\s*([a-zA-Z0-9_]+) \(([^)]+)\)\s*:\s*([^\n\r]+)", line)
+            match = arg_pattern.match(line)
             if match:
                 param_name, param_type, _ = match.groups()
                 docstring_type_hints[param_name] = param_type.strip()
@@ -37,29 +330,40 @@ def parse_google_docstring(docstring: str) -> dict:
     return {}
 
 
+# Memos whose counts --profile reports
+MEMOS = (parse_google_docstring, get_type_hints_from_args)
+
+
+def memo_counts() -> collections.Counter:
+    """Return the counts of every memo in MEMOS in this process."""
+    counts = collections.Counter()
+    for memo in MEMOS:
+        counts.update(memo.counts())
+    return counts
+
+
 def check_args_for_type_hints(args: str) -> dict:
     """
     Check function arguments for the presence of type hints; if yes, return as a dict.
 
-    If one or more args don't have a type hint return an error.
-
     Args:
         args (str): Arguments for a function as a str.
 
     Returns:
         dict: Dictionary with keys as arg names and values as arg types.
+
+    Raises:
+        ValueError: If one or more args don't have a type hint.
     """
     if len(args) == 0:
-        print("No args to check")
         function_type_hints = {}
     else:
-        list_of_args = args.replace(" ", "").split(",")
+        list_of_args = split_top_level(args.replace(" ", ""), ",")
         list_of_args = [_ for _ in list_of_args if "**" not in _]
         if all(":" in _ for _ in list_of_args):
             function_type_hints = get_type_hints_from_args(list_of_args)
         else:
-            print(f"No type hint on one or more args: {args}")
-            sys.exit(1)
+            raise ValueError(f"No type hint on one or more args: {args}")
     return function_type_hints
 
 
@@ -68,92 +372,3072 @@ def single_line_docstring(docstring: str) -> bool:
     return "\n" not in docstring and "\r" not in docstring
 
 
-def check_docstrings(filename: str) -> None:
+class FunctionInfo(NamedTuple):
+    """
+    A function found in source code, with its arguments as written and docstring.
+
+    Lines line to end_line span the signature and docstring, which is everything the
+    checks look at.
+    """
+
+    name: str
+    args: str
+    docstring: str
+    line: int
+    end_line: int
+
+
+def find_functions_regex(code: str) -> Iterator[FunctionInfo]:
+    """
+    Find functions with a triple double-quoted docstring using a regex over the source.
+
+    Args:
+        code (str): Source code to search.
+
+    Yields:
+        FunctionInfo: Each function found, in source order.
+    """
+    line, line_start = 1, 0
+    for match in PATTERNS["function"].finditer(code):
+        line += code.count("\n", line_start, match.start())
+        line_start = match.start()
+        end_line = line + code.count("\n", match.start(), match.end())
+        yield FunctionInfo(*match.groups(), line, end_line)
+
+
+class NextIndex:
+    """
+    Find the next occurrence of a substring, reusing the previous answer when possible.
+
+    If an earlier search from s0 found the substring at q, the answer for any start
+    between s0 and q is q again. When starts only move forward each character is
+    scanned at most once over all calls.
+    """
+
+    def __init__(self, text: str | bytes, sub: str | bytes) -> None:
+        self.text = text
+        self.sub = sub
+        self.start = self.found = -1
+
+    def __call__(self, start: int) -> int:
+        """Return the index of the first occurrence at or after start, or -1."""
+        if not self.start <= start <= self.found:
+            self.start = start
+            self.found = self.text.find(self.sub, start)
+            if self.found == -1:
+                # Nothing after this start, so nothing after any later start either
+                self.found = len(self.text)
+        return -1 if self.found == len(self.text) else self.found
+
+
+SCAN_PATTERNS = {
+    str: (re.compile(r"\w+\("), re.compile(r"\s*")),
+    # UTF-8 encodes every non-ASCII character of a name as bytes of 0x80 and above
+    bytes: (re.compile(rb"[\w\x80-\xff]+\("), re.compile(rb"\s*")),
+}
+
+
+def find_functions_scan(code: str | bytes) -> Iterator[FunctionInfo]:
+    """
+    Find the same functions as find_functions_regex in time linear in the size of code.
+
+    The regex backtracks on some inputs: long runs of blank lines after a signature,
+    or many "def name(" before a closing parenthesis, take quadratic time. This scanner
+    matches the same pieces in the same order, but each piece after the name only
+    depends on the position of the closing parenthesis or colon, so those results are
+    memoized by position, and searches for ")", ":" and '"' go through NextIndex. Every
+    character is then examined a bounded number of times. The positions never go
+    back, as a name can't contain "def ", so only the latest result is kept.
+
+    code can also be UTF-8 bytes with "\n" line endings, or a memory-mapped file, in
+    which case only the pieces that are yielded are decoded. Whitespace in bytes is
+    ASCII only.
+
+    Args:
+        code (str | bytes): Source code to search.
+
+    Yields:
+        FunctionInfo: Each function found, in source order.
+    """
+    is_text = isinstance(code, str)
+    name_pattern, space_pattern = SCAN_PATTERNS[str if is_text else bytes]
+
+    def literal(text: str) -> str | bytes:
+        return text if is_text else text.encode()
+
+    definition, newline, quotes, arrow = map(literal, ("def ", "\n", '"""', "->"))
+    if hasattr(code, "count"):
+        count = code.count
+    else:  # mmap
+        count = lambda sub, start, end: code[start:end].count(sub)  # noqa: E731
+    line_breaks = (literal("\r"), newline)
+    colon_char = literal(":")
+    next_paren = NextIndex(code, literal(")"))
+    next_colon = NextIndex(code, colon_char)
+    next_quote = NextIndex(code, literal('"'))
+    after_colon = [-1, None]
+    after_paren = [-1, None]
+
+    def docstring_after_colon(colon: int) -> tuple[int, int] | None:
+        # :[\r\n]+\s*"""([^"]*?)"""
+        if colon != after_colon[0]:
+            after_colon[:] = colon, None
+            i = colon + 1
+            if code[i : i + 1] in line_breaks:
+                i = space_pattern.match(code, i).end()
+                if code[i : i + 3] == quotes:
+                    end = next_quote(i + 3)
+                    if end != -1 and code[end : end + 3] == quotes:
+                        after_colon[1] = (i + 3, end)
+        return after_colon[1]
+
+    def docstring_after_paren(paren: int) -> tuple[int, int] | None:
+        # \)(?:\s|\n)*(?:->[^:]+)?:
+        if paren != after_paren[0]:
+            after_paren[:] = paren, None
+            i = space_pattern.match(code, paren + 1).end()
+            if code[i : i + 2] == arrow:
+                colon = next_colon(i + 2)
+                if colon > i + 2:
+                    after_paren[1] = docstring_after_colon(colon)
+            elif code[i : i + 1] == colon_char:
+                after_paren[1] = docstring_after_colon(i)
+        return after_paren[1]
+
+    line, line_start = 1, 0
+    pos = 0
+    while True:
+        start = code.find(definition, pos)
+        if start == -1:
+            return
+        pos = start + 1
+        name = name_pattern.match(code, start + 4)
+        if not name:
+            continue
+        paren = next_paren(name.end())
+        if paren == -1:
+            return
+        docstring = docstring_after_paren(paren)
+        if docstring is None:
+            continue
+        line += count(newline, line_start, start)
+        line_start = start
+        end_line = line + count(newline, start, docstring[1])
+        pieces = (
+            name.group()[:-1],
+            code[name.end() : paren],
+            code[docstring[0] : docstring[1]],
+        )
+        if not is_text:
+            pieces = [str(piece, "utf8") for piece in pieces]
+        yield FunctionInfo(*pieces, line, end_line)
+        pos = docstring[1] + 3
+
+
+def format_ast_args(arguments: ast.arguments, is_method: bool) -> str:
+    """
+    Format the arguments of a function from the AST as they would be written.
+
+    Defaults are dropped and so is an unannotated self or cls of a method.
+
+    Args:
+        arguments (ast.arguments): Arguments of the function.
+        is_method (bool): Whether the function is defined directly in a class body.
+
+    Returns:
+        str: Comma separated arguments with their annotations.
+    """
+    params = [(arg, "") for arg in arguments.posonlyargs + arguments.args]
+    if arguments.vararg:
+        params.append((arguments.vararg, "*"))
+    params.extend((arg, "") for arg in arguments.kwonlyargs)
+    if arguments.kwarg:
+        params.append((arguments.kwarg, "**"))
+    if (
+        is_method
+        and params
+        and params[0][0].arg in ("self", "cls")
+        and params[0][0].annotation is None
+    ):
+        params = params[1:]
+
+    formatted = []
+    for arg, prefix in params:
+        if arg.annotation is None:
+            formatted.append(f"{prefix}{arg.arg}")
+        else:
+            formatted.append(f"{prefix}{arg.arg}: {ast.unparse(arg.annotation)}")
+    return ", ".join(formatted)
+
+
+def find_functions_ast(code: str) -> Iterator[FunctionInfo]:
+    """
+    Find functions with a docstring by parsing the source into an AST.
+
+    Unlike the regex engine this handles nested parentheses, async functions, decorators
+    and docstrings of any quoting style.
+
+    Args:
+        code (str): Source code to search.
+
+    Yields:
+        FunctionInfo: Each function found, in source order.
+
+    Raises:
+        SyntaxError: If code is not valid Python.
+    """
+    stack = [(ast.parse(code), False)]
+    while stack:
+        node, in_class = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            docstring = ast.get_docstring(node, clean=False)
+            if docstring is not None:
+                args = format_ast_args(node.args, in_class)
+                end_line = node.body[0].end_lineno
+                yield FunctionInfo(node.name, args, docstring, node.lineno, end_line)
+        children = [
+            child
+            for child in ast.iter_child_nodes(node)
+            if isinstance(child, (ast.stmt, ast.excepthandler, ast.match_case))
+        ]
+        is_class = isinstance(node, ast.ClassDef)
+        stack.extend((child, is_class) for child in reversed(children))
+
+
+ENGINES = {
+    "scan": find_functions_scan,
+    "regex": find_functions_regex,
+    "ast": find_functions_ast,
+}
+
+
+class Finding(NamedTuple):
+    """A problem found in a file; line is 0 for problems with the file as a whole."""
+
+    filename: str
+    line: int
+    function: str
+    rule: str
+    message: str
+
+    def __str__(self) -> str:
+        location = f"{self.filename}:{self.line}" if self.line else self.filename
+        return f"{location}: {self.message}"
+
+
+# Descriptions of the rules findings are reported under
+RULES = {
+    "missing-docstring": "Function has no docstring.",
+    "missing-type-hint": "Argument in the signature has no type hint.",
+    "arg-count-mismatch": "Signature and docstring have different numbers of args.",
+    "arg-not-in-docstring": "Argument in the signature is not in the docstring.",
+    "type-hint-mismatch": "Signature and docstring have different type hints.",
+    "file-not-found": "File does not exist.",
+    "unreadable": "File could not be read.",
+    "decode-error": "File is not valid UTF-8.",
+    "not-python": "File is not a .py file.",
+    "syntax-error": "File could not be parsed.",
+    "timeout": "File took too long to check.",
+}
+
+
+def overlaps(ranges: list[tuple[int, int]], first: int, last: int) -> bool:
+    """Check if lines first to last overlap any of the sorted, disjoint ranges."""
+    i = bisect.bisect_left(ranges, first, key=lambda lines: lines[1])
+    return i < len(ranges) and ranges[i][0] <= last
+
+
+def parse_diff(diff: str) -> dict[str, list[tuple[int, int]]]:
+    """
+    Find the lines changed in each file from the output of git diff --unified=0.
+
+    Args:
+        diff (str): Output of git diff with no context lines and no path prefixes.
+
+    Returns:
+        dict: Sorted ranges of changed lines (in the new version) keyed by file path.
+    """
+    changed = {}
+    ranges = None
+    for line in diff.splitlines():
+        if line.startswith("+++ "):
+            path = line[4:]
+            ranges = None if path == "/dev/null" else changed.setdefault(path, [])
+            continue
+        match = PATTERNS["hunk header"].match(line)
+        if match and ranges is not None:
+            start = int(match.group(1))
+            count = 1 if match.group(2) is None else int(match.group(2))
+            if count == 0:
+                # Lines were deleted after line start, so mark both sides of the gap
+                ranges.append((max(start, 1), start + 1))
+            else:
+                ranges.append((start, start + count - 1))
+    return changed
+
+
+def changed_lines(since: str | None = None) -> dict[str, list[tuple[int, int]]]:
+    """
+    Ask git which lines are changed, either staged for commit or since a revision.
+
+    The staged line numbers are those of the index, while files are read from the
+    working tree, so files with unstaged changes should be stashed first, as
+    pre-commit does.
+
+    Args:
+        since (str | None): Revision to diff the working tree against. By default the
+            staged changes are used.
+
+    Returns:
+        dict: Sorted ranges of changed lines keyed by real path, with symlinks resolved.
+
+    Raises:
+        RuntimeError: If git is not installed or the diff fails.
+    """
+    command = ["-c", "core.quotePath=false", "diff", "--unified=0"]
+    command += ["--no-color", "--no-ext-diff", "--no-prefix", "--no-relative"]
+    command += ["--cached"] if since is None else [since]
+    changed = parse_diff(run_git(command))
+    # The diff has paths relative to the root of the repository, wherever it is run
+    root = run_git(["rev-parse", "--show-toplevel"]).rstrip("\n")
+    return {
+        os.path.realpath(os.path.join(root, path)): ranges
+        for path, ranges in changed.items()
+    }
+
+
+def run_git(args: Sequence[str]) -> str:
+    """
+    Run git with args and return what it printed.
+
+    Args:
+        args (Sequence[str]): Arguments for git, without the git command itself.
+
+    Returns:
+        str: What git printed to stdout.
+
+    Raises:
+        RuntimeError: If git is not installed or the command fails.
+    """
+    import subprocess
+
+    try:
+        result = subprocess.run(
+            ["git", *args],
+            capture_output=True,
+            check=True,
+            text=True,
+            encoding="utf8",
+            errors="surrogateescape",  # Paths are bytes to git, like to os
+        )
+    except FileNotFoundError as exc:
+        raise RuntimeError("git is not installed") from exc
+    except subprocess.CalledProcessError as exc:
+        raise RuntimeError(exc.stderr.strip()) from exc
+    return result.stdout
+
+
+def git_blob_ids(paths: Sequence[str]) -> dict[str, str]:
+    """
+    Ask git for the blob ID of each tracked file under paths that is unmodified.
+
+    A file's blob ID is the hash git keeps of its content in the index, so it can
+    stand in for hashing the content. Files that differ from the index in the working
+    tree are left out, as are those with merge conflicts, symlinks, and files marked
+    skip-worktree or assume-unchanged, whose changes git doesn't look for.
+
+    Args:
+        paths (Sequence[str]): Files and directories from the command line.
+
+    Returns:
+        dict: Blob IDs keyed by real path, with symlinks resolved.
+
+    Raises:
+        RuntimeError: If git is not installed, or a path is outside a repository.
+    """
+    # Status refreshes the stat info in git's index, as it does for every git status,
+    # so later runs don't have to hash files that were checked out recently again
+    status = ["status", "--porcelain", "-z", "--untracked-files=no", "--no-renames"]
+    status += ["--ignore-submodules", "--", *paths]
+    # Each entry is "XY <path>", where Y isn't a space if the working tree differs
+    modified = {
+        entry[3:]
+        for entry in run_git(["--literal-pathspecs", *status]).split("\0")
+        if entry[1:2].strip()
+    }
+    # Both give paths relative to the root of the repository, not the current directory
+    root = run_git(["rev-parse", "--show-toplevel"]).rstrip("\n")
+    blobs = {}
+    command = ["--literal-pathspecs", "ls-files", "-z", "--full-name", "--stage", "-v"]
+    # Each entry is "<tag> <mode> <blob> <stage>\t<path>"; the tag is H when cached
+    for entry in run_git([*command, "--", *paths]).split("\0"):
+        if not entry:
+            continue
+        info, _, path = entry.partition("\t")
+        tag, mode, blob, stage = info.split()
+        if tag == "H" and mode in ("100644", "100755") and stage == "0":
+            if path not in modified:
+                blobs[os.path.realpath(os.path.join(root, path))] = blob
+    return blobs
+
+
+class Profile:
+    """
+    Wall and CPU time spent in each phase of checking, and the slowest files/functions.
+
+    Each worker records a Profile per file, which the parent merges into one for the
+    run. When profiling is off None is passed around instead, and phases are run
+    through untimed() or phase_timer(), which cost next to nothing. Counts of files
+    and bytes checked or skipped by the prefilter are kept too.
+    """
+
+    PHASES = (
+        "prefilter",
+        "cache",
+        "read",
+        "decode",
+        "extract",
+        "parse args",
+        "parse docstring",
+        "compare",
+    )
+    TOP = 10
+
+    def __init__(self) -> None:
+        self.phases = {}
+        self.files = []
+        self.functions = []
+        self.counts = collections.Counter()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the time spent in the with block to the named phase."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def call(self, name: str, function: Callable, *args: object) -> object:
+        """Call function with args, adding the time it takes to the named phase."""
+        with self.phase(name):
+            return function(*args)
+
+    def add(self, name: str, wall: float, cpu: float) -> None:
+        """Add wall and CPU seconds to the named phase."""
+        totals = self.phases.setdefault(name, [0.0, 0.0])
+        totals[0] += wall
+        totals[1] += cpu
+
+    def timed(self, iterable: Iterable, name: str) -> Iterator:
+        """Yield from iterable, adding the time spent getting each item to a phase."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def add_slowest(self, entries: list, entry: tuple) -> None:
+        """Add entry, whose first item is its time, to entries if among the TOP."""
+        if len(entries) < self.TOP:
+            heapq.heappush(entries, entry)
+        else:
+            heapq.heappushpop(entries, entry)
+
+    def merge(self, other: "Profile") -> None:
+        """Add the times recorded in another profile to this one."""
+        for name, (wall, cpu) in other.phases.items():
+            self.add(name, wall, cpu)
+        for entry in other.files:
+            self.add_slowest(self.files, entry)
+        for entry in other.functions:
+            self.add_slowest(self.functions, entry)
+        self.counts.update(other.counts)
+
+    def report(self) -> str:
+        """Return a summary of where the time went."""
+        lines = [f"{'phase':<16} {'wall (s)':>10} {'cpu (s)':>10}"]
+        names = [name for name in self.PHASES if name in self.phases]
+        names += sorted(set(self.phases) - set(self.PHASES))
+        for name in names:
+            wall, cpu = self.phases[name]
+            lines.append(f"{name:<16} {wall:>10.4f} {cpu:>10.4f}")
+        lines.append("Slowest files:")
+        for wall, filename in sorted(self.files, reverse=True):
+            lines.append(f"{wall:>10.4f}s  {filename}")
+        lines.append("Slowest functions:")
+        for wall, filename, line, name in sorted(self.functions, reverse=True):
+            lines.append(f"{wall:>10.4f}s  {filename}:{line} {name}")
+        if self.counts["files skipped"]:
+            skipped = self.counts["files skipped"]
+            total = skipped + self.counts["files checked"]
+            megabytes = self.counts["bytes skipped"] / 1e6
+            lines.append(
+                f"Prefilter skipped {skipped} of {total} files ({megabytes:.1f} MB)"
+            )
+            if self.counts["bytes checked"]:
+                # Skipped files would have been decoded and searched for functions,
+                # at about the same speed per byte as the files that were checked
+                wall = sum(self.phases.get(name, (0.0,))[0] for name in SKIPPED_PHASES)
+                rate = wall / self.counts["bytes checked"]
+                seconds = rate * self.counts["bytes skipped"]
+                seconds -= self.phases.get("prefilter", (0.0,))[0]
+                lines.append(f"Estimated time saved: {seconds:.4f}s")
+        for memo in MEMOS:
+            hits, misses, evictions = (self.counts[name] for name in memo.counts())
+            if hits or misses:
+                lines.append(
+                    f"{memo.__name__}: {hits} hits, {misses} misses, "
+                    f"{evictions} evictions"
+                )
+        if self.counts["files unchanged"]:
+            lines.append(
+                f"Skipped {self.counts['files unchanged']} files whose stat was "
+                "unchanged"
+            )
+        if self.counts["files unchanged in git"]:
+            lines.append(
+                f"Skipped {self.counts['files unchanged in git']} files whose git "
+                "blob was checked before"
+            )
+        if self.counts["functions reused"]:
+            reused = self.counts["functions reused"]
+            total = reused + self.counts["functions checked"]
+            lines.append(
+                f"Reused the verdicts of {reused} of {total} functions in changed files"
+            )
+        return "\n".join(lines) + "\n"
+
+
+SKIPPED_PHASES = ("decode", "extract")
+
+
+def phase_timer(profile: Profile | None) -> Callable:
+    """Return profile.phase, or a function returning a no-op context for no profile."""
+    if profile is None:
+        return lambda name: NO_PHASE
+    return profile.phase
+
+
+NO_PHASE = contextlib.nullcontext()
+
+
+def untimed(name: str, function: Callable, *args: object) -> object:
+    """Call function with args; the stand-in for Profile.call when not profiling."""
+    return function(*args)
+
+
+class ProgressLog:
+    """
+    Collect the progress messages for a file that are within the verbosity level.
+
+    Messages are formatted with % only if they will be kept, so at the default
+    verbosity logging costs a comparison.
+    """
+
+    def __init__(self, verbosity: int = 0) -> None:
+        self.verbosity = verbosity
+        self.lines = []
+
+    def log(self, level: int, message: str, *args: object) -> None:
+        """Keep message % args if the verbosity is at least level."""
+        if level <= self.verbosity:
+            self.lines.append(message % args + "\n" if args else message + "\n")
+
+    def getvalue(self) -> str:
+        """Return the messages kept so far."""
+        return "".join(self.lines)
+
+
+NO_LOG = ProgressLog()
+
+
+def may_have_findings(content: bytes, engine: str) -> bool:
+    """
+    Cheaply rule out the files that the engine can find no problems in.
+
+    The scan and regex engines only look at a def followed by a triple quoted
+    docstring, so a file without both has nothing for them to check. Every file is
+    parsed by the AST engine, which also finds docstrings in triple single quotes,
+    and syntax errors, that the test for triple double quotes would miss.
+
+    Args:
+        content (bytes): Content of the file.
+        engine (str): Name of the engine in ENGINES used to find functions.
+
+    Returns:
+        bool: False if the file can't have any findings, True if it must be checked.
+    """
+    if engine == "ast":
+        return True
+    start = content.find(b"def")
+    return start != -1 and content.find(b'"""', start) != -1
+
+
+def check_docstrings(
+    filename: str,
+    engine: str = "scan",
+    timeout: float | None = None,
+    lines: list[tuple[int, int]] | None = None,
+    profile: Profile | None = None,
+    log: ProgressLog = NO_LOG,
+) -> list[Finding]:
     """
     Check that the docstrings of functions in filename are consistent in with the type hints.
 
     Args:
         filename (str): Path to the file to check.
+        engine (str): Name of the engine in ENGINES used to find functions.
+        timeout (float | None): Seconds after which to stop checking the file.
+        lines (list[tuple[int, int]] | None): If given, only check functions whose
+            signature or docstring overlaps one of these ranges of lines.
+        profile (Profile | None): Profile to record the time spent in to.
+        log (ProgressLog): Log to write progress messages to.
+
+    Returns:
+        list: Findings for every problem in the file, empty if there are none.
     """
     try:
-        with open(filename, "r", encoding="utf8") as file:
-            code = file.read()
-    except FileNotFoundError:
-        print("Error: No such file or directory: ", filename)
-        sys.exit(1)
+        with phase_timer(profile)("read"):
+            with open(filename, "r", encoding="utf8") as file:
+                code = file.read()
+    except (OSError, UnicodeDecodeError) as exc:
+        return [file_error_finding(filename, exc)]
 
-    if not filename.endswith(".py"):
-        print("Error: This hook only accepts '.py' filetypes. You passed: ", filename)
-        sys.exit(1)
+    return check_code(code, filename, engine, timeout, lines, profile, log)
 
-    # Find all function definitions and their docstrings
-    pattern = (
-        r"def (\w+)\(([^)]*)\)(?:\s|\n)*(?:->[^:]+)?:[\r\n]+\s*\"\"\"([^\"]*?)\"\"\""
+
+def file_error_finding(filename: str, exc: OSError | UnicodeDecodeError) -> Finding:
+    """
+    Return the finding for a file that couldn't be read or decoded.
+
+    Args:
+        filename (str): Path to the file.
+        exc (OSError | UnicodeDecodeError): Error raised reading or decoding it.
+
+    Returns:
+        Finding: A finding for the whole file, so the other files are still checked.
+    """
+    if isinstance(exc, FileNotFoundError):
+        message = "No such file or directory."
+        return Finding(filename, 0, "", "file-not-found", message)
+    if isinstance(exc, UnicodeDecodeError):
+        message = f"Could not decode file as UTF-8: {exc.reason}."
+        return Finding(filename, 0, "", "decode-error", message)
+    message = f"Could not read file: {exc.strerror or exc}."
+    return Finding(filename, 0, "", "unreadable", message)
+
+
+def check_code(
+    code: str,
+    filename: str,
+    engine: str = "scan",
+    timeout: float | None = None,
+    lines: list[tuple[int, int]] | None = None,
+    profile: Profile | None = None,
+    log: ProgressLog = NO_LOG,
+    verdicts: dict | None = None,
+) -> list[Finding]:
+    """
+    Check that the docstrings of functions in code are consistent with the type hints.
+
+    The timeout is checked after each function, so it bounds the time spent on a file
+    as long as finding the next function is fast, which the scan engine guarantees.
+    If it runs out a "timeout" finding is added and the rest of the file is skipped.
+
+    Args:
+        code (str): Source code read from filename.
+        filename (str): Path the code was read from, used for messages.
+        engine (str): Name of the engine in ENGINES used to find functions.
+        timeout (float | None): Seconds after which to stop checking the file.
+        lines (list[tuple[int, int]] | None): If given, only check functions whose
+            signature or docstring overlaps one of these sorted ranges of lines.
+        profile (Profile | None): Profile to record the time spent in to.
+        log (ProgressLog): Log to write progress messages to.
+        verdicts (dict | None): Findings of functions from the last check, to reuse,
+            as described in check_functions.
+
+    Returns:
+        list: Findings for every problem in the code, empty if there are none.
+    """
+    if not filename.endswith(".py"):
+        message = "This hook only accepts '.py' filetypes."
+        return [Finding(filename, 0, "", "not-python", message)]
+    return check_functions(
+        code, filename, engine, timeout, lines, profile, log, verdicts
     )
-    matches = re.finditer(pattern, code, re.DOTALL)
 
-    for match in matches:
-        function_name, args, docstring = match.groups()
-        print(f"Checking docstring for function '{function_name}' in {filename}...")
 
-        # Check if the docstring is present
-        if not docstring:
-            print(f"Error: Function '{function_name}' is missing a docstring.")
-            sys.exit(1)
+def check_functions(
+    code: str,
+    filename: str,
+    engine: str = "scan",
+    timeout: float | None = None,
+    lines: list[tuple[int, int]] | None = None,
+    profile: Profile | None = None,
+    log: ProgressLog = NO_LOG,
+    verdicts: dict | None = None,
+) -> list[Finding]:
+    """
+    Check each function in code, whatever the name of the file it came from.
 
-        function_type_hints = check_args_for_type_hints(args)
+    A function's findings only depend on its name, args and docstring, so with
+    verdicts a function whose fingerprint of those was checked last time isn't
+    checked again. Its findings are rebuilt from the rule and message of each,
+    at its current line.
 
-        # Parse the docstring to extract argument names and types
-        docstring_type_hints = parse_google_docstring(docstring)
+    Args:
+        code (str): Python source code.
+        filename (str): Name to give the code in findings.
+        engine (str): Name of the engine in ENGINES used to find functions.
+        timeout (float | None): Seconds after which to stop checking the code.
+        lines (list[tuple[int, int]] | None): If given, only check functions whose
+            signature or docstring overlaps one of these sorted ranges of lines.
+        profile (Profile | None): Profile to record the time spent in to.
+        log (ProgressLog): Log to write progress messages to.
+        verdicts (dict | None): Rule and message of each finding of the functions
+            checked last time, by fingerprint. Replaced with those of this check.
 
-        # Check the same number of args in function as in docstring
-        if len(function_type_hints) != len(
-            docstring_type_hints
-        ) and not single_line_docstring(docstring):
-            print(
-                f"There are {len(function_type_hints)} arguments in the function "
-                f"{function_name} but {len(docstring_type_hints)} in the docstring."
-            )
-            sys.exit(1)
+    Returns:
+        list: Findings for every problem in the code, empty if there are none.
+    """
+    findings = []
+    previous, current = verdicts or {}, {}
+    # Find all function definitions and their docstrings
+    functions = ENGINES[engine](code)
+    if profile is not None:
+        functions = profile.timed(functions, "extract")
+    deadline = time.monotonic() + timeout if timeout else None
 
-        # Compare type hints from the function signature and docstring
-        for arg_name, arg_type in function_type_hints.items():
-            if arg_name not in docstring_type_hints:
-                if single_line_docstring(docstring):
-                    print("Single line docstring, nothing to check.")
-                else:
-                    print(
-                        f"Error: Argument '{arg_name}' or its typehint is "
-                        f"not in the docstring for function '{function_name}'."
-                    )
-                    sys.exit(1)
-            if (
-                arg_name in docstring_type_hints
-                and docstring_type_hints[arg_name] != arg_type
+    try:
+        for function in functions:
+            if lines is not None and not overlaps(
+                lines, function.line, function.end_line
             ):
-                print(
-                    "Error: Type hint mismatch for argument "
-                    f"'{arg_name}' in function '{function_name}'."
+                continue
+            if profile is not None:
+                start = time.perf_counter()
+            key = None if verdicts is None else function_fingerprint(function)
+            verdict = previous.get(key)
+            if verdict is None:
+                results = check_function(
+                    function.name,
+                    function.args,
+                    function.docstring,
+                    filename,
+                    function.line,
+                    profile,
+                    log,
+                )
+                verdict = [(finding.rule, finding.message) for finding in results]
+            else:
+                location = (filename, function.line, function.name)
+                results = [Finding(*location, *finding) for finding in verdict]
+            findings.extend(results)
+            if key is not None:
+                current[key] = verdict
+            if profile is not None:
+                seconds = time.perf_counter() - start
+                entry = (seconds, filename, function.line, function.name)
+                profile.add_slowest(profile.functions, entry)
+            if deadline is not None and time.monotonic() > deadline:
+                message = (
+                    f"Gave up after {timeout:g}s, functions after '{function.name}' "
+                    "were not checked."
                 )
-                sys.exit(1)
+                location = (filename, function.line, function.name)
+                findings.append(Finding(*location, "timeout", message))
+                break
+    except SyntaxError as exc:
+        message = f"Could not parse file: {exc.msg}."
+        findings.append(Finding(filename, exc.lineno or 0, "", "syntax-error", message))
 
+    if verdicts is not None:
+        if profile is not None:
+            reused = sum(key in previous for key in current)
+            checked = len(current) - reused
+            counts = {"functions reused": reused, "functions checked": checked}
+            profile.counts.update(counts)
+        verdicts.clear()
+        verdicts.update(current)
+    return findings
 
-def main(argv: Sequence[str] | None = None) -> int:
-    """Check typehints of docstring and args of functions in files for consistency."""
-    parser = argparse.ArgumentParser(
-        description="Check docstrings and type hints in Python files."
-    )
-    parser.add_argument("filenames", nargs="*", help="List of Python files to check")
-    args = parser.parse_args(argv)
 
-    if len(args.filenames) == 0:
-        print("No files to check.")
-        sys.exit(1)
+def function_fingerprint(function: FunctionInfo) -> str:
+    """Return a digest of everything about a function that its findings depend on."""
+    text = "\0".join((function.name, function.args, function.docstring))
+    return hashlib.blake2b(text.encode("utf8"), digest_size=16).hexdigest()
+
+
+def check_function(
+    function_name: str,
+    args: str,
+    docstring: str,
+    filename: str,
+    line: int,
+    profile: Profile | None = None,
+    log: ProgressLog = NO_LOG,
+) -> list[Finding]:
+    """
+    Check that the docstring of a function is consistent with its type hints.
 
-    for fname in args.filenames:
-        check_docstrings(fname)
+    Args:
+        function_name (str): Name of the function.
+        args (str): Arguments of the function as written in its signature.
+        docstring (str): Docstring of the function.
+        filename (str): Path of the file the function is in, used for messages.
+        line (int): Line the function is defined on, used for messages.
+        profile (Profile | None): Profile to record the time spent in to.
+        log (ProgressLog): Log to write progress messages to.
+
+    Returns:
+        list: Findings for every problem with the function, empty if there are none.
+    """
+    message = "Checking docstring for function '%s' in %s..."
+    log.log(PROGRESS, message, function_name, filename)
+    location = (filename, line, function_name)
+
+    # Check if the docstring is present
+    if not docstring:
+        message = f"Function '{function_name}' is missing a docstring."
+        return [Finding(*location, "missing-docstring", message)]
+
+    call = untimed if profile is None else profile.call
+    try:
+        function_type_hints = call("parse args", check_args_for_type_hints, args)
+    except ValueError as exc:
+        return [Finding(*location, "missing-type-hint", str(exc))]
+    if not function_type_hints:
+        log.log(DETAIL, "No args to check")
+
+    # Parse the docstring to extract argument names and types
+    docstring_type_hints = call("parse docstring", parse_google_docstring, docstring)
+
+    return call(
+        "compare",
+        compare_type_hints,
+        function_type_hints,
+        docstring_type_hints,
+        docstring,
+        location,
+        log,
+    )
+
+
+def compare_type_hints(
+    function_type_hints: dict,
+    docstring_type_hints: dict,
+    docstring: str,
+    location: tuple[str, int, str],
+    log: ProgressLog = NO_LOG,
+) -> list[Finding]:
+    """
+    Compare the type hints of a function's signature with those in its docstring.
+
+    Args:
+        function_type_hints (dict): Type hints from the signature, keyed by arg name.
+        docstring_type_hints (dict): Type hints from the docstring, keyed by arg name.
+        docstring (str): Docstring of the function.
+        location (tuple[str, int, str]): File, line and name of the function.
+        log (ProgressLog): Log to write progress messages to.
+
+    Returns:
+        list: Findings for every mismatch, empty if there are none.
+    """
+    function_name = location[2]
+    findings = []
+
+    # Check the same number of args in function as in docstring
+    if len(function_type_hints) != len(
+        docstring_type_hints
+    ) and not single_line_docstring(docstring):
+        message = (
+            f"There are {len(function_type_hints)} arguments in the function "
+            f"{function_name} but {len(docstring_type_hints)} in the docstring."
+        )
+        findings.append(Finding(*location, "arg-count-mismatch", message))
+
+    # Compare type hints from the function signature and docstring
+    for arg_name, arg_type in function_type_hints.items():
+        if arg_name not in docstring_type_hints:
+            if single_line_docstring(docstring):
+                log.log(DETAIL, "Single line docstring, nothing to check.")
+            else:
+                message = (
+                    f"Argument '{arg_name}' or its typehint is "
+                    f"not in the docstring for function '{function_name}'."
+                )
+                findings.append(Finding(*location, "arg-not-in-docstring", message))
+        if arg_name in docstring_type_hints and normalize_type_hint(
+            docstring_type_hints[arg_name]
+        ) != normalize_type_hint(arg_type):
+            message = (
+                "Type hint mismatch for argument "
+                f"'{arg_name}' in function '{function_name}'."
+            )
+            findings.append(Finding(*location, "type-hint-mismatch", message))
+
+    return findings
+
+
+class IgnoreRule(NamedTuple):
+    """
+    Consecutive lines of a .gitignore file with the same effect, as one regex.
+
+    The regex matches paths relative to base, the directory of the .gitignore file.
+    """
+
+    base: str
+    regex: re.Pattern
+    negate: bool
+    dir_only: bool
+
+
+def translate_gitignore_pattern(pattern: str) -> str:
+    """
+    Translate a .gitignore glob into a regex matching relative paths.
+
+    Args:
+        pattern (str): Glob with any leading "!" and trailing "/" removed.
+
+    Returns:
+        str: Regex to fullmatch against a path relative to the .gitignore's directory.
+    """
+    # Patterns without a slash (except at the end) match at any depth
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    parts = [] if anchored else ["(?:.*/)?"]
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            members = pattern[i + 1 : end]
+            if members.startswith("!"):
+                members = "^" + members[1:]
+            members = members.replace("\\", "\\\\")
+            parts.append(f"[{members}]")
+            i = end
+        elif char == "\\" and i + 1 < len(pattern):
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return "".join(parts)
+
+
+def read_gitignore(path: str, base: str) -> list[IgnoreRule]:
+    """
+    Read the rules in a .gitignore (or .git/info/exclude) file.
+
+    Args:
+        path (str): Path of the file, which need not exist.
+        base (str): Absolute path of the directory the patterns are relative to.
+
+    Returns:
+        list: Rules in the order they appear in the file.
+    """
+    try:
+        with open(path, "r", encoding="utf8", errors="replace") as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return []
+
+    groups = []
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith("\\"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+        if groups and groups[-1][0] == (negate, dir_only):
+            groups[-1][1].append(translate_gitignore_pattern(line))
+        else:
+            groups.append(((negate, dir_only), [translate_gitignore_pattern(line)]))
+    return [
+        IgnoreRule(base, re.compile("|".join(regexes)), negate, dir_only)
+        for (negate, dir_only), regexes in groups
+    ]
+
+
+def is_ignored(rules: list[IgnoreRule], path: str, is_dir: bool) -> bool:
+    """Check if the rules, later ones taking precedence, ignore an absolute path."""
+    for rule in reversed(rules):
+        if rule.dir_only and not is_dir:
+            continue
+        relative = path[len(rule.base) + 1 :].replace(os.sep, "/")
+        if rule.regex.fullmatch(relative):
+            return not rule.negate
+    return False
+
+
+def ancestor_ignore_rules(directory: str) -> list[IgnoreRule]:
+    """
+    Read the ignore rules that apply to directory from the git repository around it.
+
+    These come from .git/info/exclude and the .gitignore files from the root of the
+    repository down to, but not including, directory itself.
+
+    Args:
+        directory (str): Absolute path of a directory.
+
+    Returns:
+        list: Rules in order of increasing precedence, empty outside a repository.
+    """
+    ancestors = []
+    current = directory
+    while not os.path.exists(os.path.join(current, ".git")):
+        parent = os.path.dirname(current)
+        if parent == current:
+            return []
+        current = parent
+        ancestors.append(current)
+    rules = read_gitignore(os.path.join(current, ".git", "info", "exclude"), current)
+    for ancestor in reversed(ancestors):
+        rules += read_gitignore(os.path.join(ancestor, ".gitignore"), ancestor)
+    return rules
+
+
+def walk_python_files(
+    root: str,
+    include: Sequence[str] = DEFAULT_INCLUDE,
+    exclude: Sequence[str] = DEFAULT_EXCLUDE,
+    gitignore: bool = True,
+    dirs: bool = False,
+) -> Iterator[str]:
+    """
+    Yield the files under root to check, in sorted order, as they are discovered.
+
+    Args:
+        root (str): Directory to search recursively.
+        include (Sequence[str]): Globs a file name must match one of.
+        exclude (Sequence[str]): Globs matched against names and paths relative to
+            root; matching files and directories are skipped.
+        gitignore (bool): Whether to skip files and directories ignored by git.
+        dirs (bool): Whether to also yield root and each directory walked.
+
+    Yields:
+        str: Path of each file found, starting with root.
+    """
+    rules = ancestor_ignore_rules(os.path.abspath(root)) if gitignore else []
+    if dirs:
+        yield root
+    yield from walk_directory(
+        root,
+        os.path.abspath(root),
+        "",
+        rules,
+        compile_globs(include),
+        compile_globs(exclude),
+        gitignore,
+        dirs,
+    )
+
+
+def compile_globs(patterns: Sequence[str]) -> re.Pattern:
+    """Compile globs into one regex that matches what any of them match."""
+    if not patterns:
+        return re.compile("(?!)")
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns))
+
+
+def walk_directory(
+    path: str,
+    absolute: str,
+    relative: str,
+    rules: list[IgnoreRule],
+    include: re.Pattern,
+    exclude: re.Pattern,
+    gitignore: bool,
+    dirs: bool = False,
+) -> Iterator[str]:
+    """
+    Yield the files to check in one directory, recursing into its subdirectories.
+
+    Args:
+        path (str): Path of the directory as it should appear in results.
+        absolute (str): Absolute path of the directory, for .gitignore matching.
+        relative (str): Path of the directory relative to the root of the walk.
+        rules (list[IgnoreRule]): Ignore rules from the directories above.
+        include (re.Pattern): Compiled globs a file name must match.
+        exclude (re.Pattern): Compiled globs for names and relative paths to skip.
+        gitignore (bool): Whether to read .gitignore files.
+        dirs (bool): Whether to also yield each subdirectory walked.
+
+    Yields:
+        str: Path of each file found.
+    """
+    if gitignore:
+        rules = rules + read_gitignore(os.path.join(absolute, ".gitignore"), absolute)
+    try:
+        with os.scandir(path) as scanner:
+            entries = sorted(scanner, key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        entry_relative = f"{relative}/{entry.name}" if relative else entry.name
+        if exclude.match(entry.name) or exclude.match(entry_relative):
+            continue
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            continue
+        entry_absolute = os.path.join(absolute, entry.name)
+        if rules and is_ignored(rules, entry_absolute, is_dir):
+            continue
+        if is_dir:
+            if dirs:
+                yield entry.path
+            yield from walk_directory(
+                entry.path,
+                entry_absolute,
+                entry_relative,
+                rules,
+                include,
+                exclude,
+                gitignore,
+                dirs,
+            )
+        elif include.match(entry.name):
+            yield entry.path
+
+
+def expand_paths(
+    paths: Sequence[str],
+    include: Sequence[str] = DEFAULT_INCLUDE,
+    exclude: Sequence[str] = DEFAULT_EXCLUDE,
+    gitignore: bool = True,
+) -> Iterator[str]:
+    """
+    Yield files as given and the files found by walking directories, without repeats.
+
+    Args:
+        paths (Sequence[str]): Files and directories from the command line.
+        include (Sequence[str]): Globs a file name in a directory must match one of.
+        exclude (Sequence[str]): Globs for names and relative paths to skip.
+        gitignore (bool): Whether to skip files and directories ignored by git.
+
+    Yields:
+        str: Path of each file to check.
+    """
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            found = walk_python_files(path, include, exclude, gitignore)
+        else:
+            found = [path]
+        for filename in found:
+            key = os.path.normpath(filename)
+            if key not in seen:
+                seen.add(key)
+                yield filename
+
+
+def read_source(filename: str, allow_mmap: bool = False) -> bytes | mmap.mmap:
+    """
+    Return the content of a file, memory-mapped if allowed and the file is large.
+
+    A mapped file is read by the OS as it is searched, so a huge file doesn't need to
+    be in memory all at once. The caller must close it.
+
+    Args:
+        filename (str): Path to the file.
+        allow_mmap (bool): Whether to map files of at least MMAP_MIN_SIZE bytes.
+
+    Returns:
+        bytes | mmap.mmap: Content of the file.
+
+    Raises:
+        OSError: If the file can't be read.
+    """
+    with open(filename, "rb") as file:
+        if allow_mmap and os.fstat(file.fileno()).st_size >= max(MMAP_MIN_SIZE, 1):
+            try:
+                return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                pass  # Not mappable, e.g. a pipe or a file that was truncated
+        return file.read()
+
+
+def decode_source(content: bytes | mmap.mmap) -> str:
+    """Decode file content the same way reading it in text mode would."""
+    return str(content, "utf8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def check_utf8(content: mmap.mmap) -> None:
+    """
+    Check that memory-mapped content is UTF-8, decoding a chunk at a time.
+
+    The scan engine only decodes the parts of a mapped file it finds, so without this
+    a bad byte elsewhere would go unreported, unlike in a file small enough to read.
+
+    Args:
+        content (mmap.mmap): Content of the file.
+
+    Raises:
+        UnicodeDecodeError: If the content isn't valid UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder("utf8")()
+    for start in range(0, len(content), UTF8_CHECK_CHUNK):
+        decoder.decode(content[start : start + UTF8_CHECK_CHUNK])
+    decoder.decode(b"", final=True)
+
+
+# Older databases are emptied, as anything in the cache can be checked again
+CACHE_SCHEMA_VERSION = 2
+CACHE_SCHEMA = (
+    "DROP TABLE IF EXISTS results",
+    "DROP TABLE IF EXISTS stats",
+    "DROP TABLE IF EXISTS totals",
+    """CREATE TABLE results (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        used INTEGER NOT NULL
+    )""",
+    "CREATE INDEX results_used ON results (used)",
+    # The total size of the results, kept up to date so runs don't sum the table
+    "CREATE TABLE totals (bytes INTEGER NOT NULL)",
+    "INSERT INTO totals VALUES (0)",
+    """CREATE TRIGGER results_insert AFTER INSERT ON results BEGIN
+        UPDATE totals SET bytes = bytes + new.size;
+    END""",
+    """CREATE TRIGGER results_update AFTER UPDATE OF size ON results BEGIN
+        UPDATE totals SET bytes = bytes + new.size - old.size;
+    END""",
+    """CREATE TRIGGER results_delete AFTER DELETE ON results BEGIN
+        UPDATE totals SET bytes = bytes - old.size;
+    END""",
+    # The result of each file is in results, so evicting it drops the row here too
+    """CREATE TABLE stats (
+        options TEXT NOT NULL,
+        path TEXT NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        inode INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        PRIMARY KEY (options, path)
+    )""",
+    f"PRAGMA user_version = {CACHE_SCHEMA_VERSION}",
+)
+
+
+def default_cache_dir() -> str:
+    """
+    Return the cache directory to use unless another is given, one for each user.
+
+    It is on the local disk even when the checked tree is on a network filesystem,
+    where the database couldn't be shared safely, and it is shared by every worktree.
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "check_docstrings")
+
+
+def open_cache_database(directory: str) -> "sqlite3.Connection":
+    """
+    Open the cache database in directory, creating it if needed.
+
+    Args:
+        directory (str): Cache directory, created with a .gitignore if missing.
+
+    Returns:
+        sqlite3.Connection: Connection in autocommit mode, so each statement is its
+            own transaction unless one is begun explicitly.
+
+    Raises:
+        OSError: If the directory can't be created.
+        sqlite3.Error: If the database can't be opened.
+    """
+    import sqlite3
+
+    os.makedirs(directory, exist_ok=True)
+    gitignore = os.path.join(directory, ".gitignore")
+    if not os.path.exists(gitignore):
+        with open(gitignore, "w", encoding="utf8") as file:
+            file.write("# Created by check_docstrings\n*\n")
+    connection = sqlite3.connect(
+        os.path.join(directory, CACHE_FILENAME),
+        timeout=CACHE_BUSY_SECONDS,
+        isolation_level=None,
+    )
+    try:
+        # In WAL mode readers don't block the writer or each other, and commits
+        # don't need to fsync
+        try:
+            mode = connection.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        except sqlite3.OperationalError:
+            mode = None
+        if mode == "wal":
+            connection.execute("PRAGMA synchronous=NORMAL")
+        else:
+            # WAL needs shared memory, which some filesystems, e.g. network ones,
+            # don't have, so fall back to a rollback journal
+            connection.execute("PRAGMA journal_mode=DELETE")
+        (version,) = connection.execute("PRAGMA user_version").fetchone()
+        if version != CACHE_SCHEMA_VERSION:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have created the tables while this one waited
+                (version,) = connection.execute("PRAGMA user_version").fetchone()
+                if version != CACHE_SCHEMA_VERSION:
+                    for statement in CACHE_SCHEMA:
+                        connection.execute(statement)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+    except sqlite3.Error:
+        connection.close()
+        raise
+    return connection
+
+
+class ResultCache:
+    """
+    Cache of per-file results in an SQLite database, shared by processes and worktrees.
+
+    Keys hash the file content together with the checker version and the options that
+    affect the result, so an entry can never be stale; changing any of them just misses.
+    The database is in WAL mode, so worker processes, concurrent runs and runs in
+    other worktrees can all read and write it at once, each with its own connection.
+    Entries record when they were last used, and evict() removes the least recently
+    used once the entries take more than max_bytes. Errors are ignored, so the cache
+    never fails a check. An optional in-memory layer keeps recently used entries
+    across runs in the daemon; it is not sent to worker processes.
+
+    When a file changes, its result misses, but most of its functions usually haven't
+    changed. So the verdicts for each function of the last version of each file are
+    kept too, keyed by the file's path instead of its content.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        options: dict | None = None,
+        memory: collections.OrderedDict | None = None,
+        max_bytes: int = DEFAULT_CACHE_MAX_SIZE,
+    ) -> None:
+        self.directory = directory
+        self.options = options or {}
+        self.memory = memory
+        self.max_bytes = max_bytes
+        self.connection = None
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, "memory": None, "connection": None}
+
+    @property
+    def db(self) -> "sqlite3.Connection":
+        """Connection to the database, opened on first use in each process."""
+        if self.connection is None:
+            self.connection = open_cache_database(self.directory)
+        return self.connection
+
+    def close(self) -> None:
+        """Close the connection to the database, if it was opened."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def key(self, content: bytes, filename: str) -> str:
+        """Return the cache key for filename having the given content."""
+        digest = hashlib.sha256()
+        header = [__version__, filename, sorted(self.options.items())]
+        digest.update(json.dumps(header).encode("utf8"))
+        digest.update(b"\0")
+        digest.update(content)
+        return digest.hexdigest()
+
+    def blob_key(self, blob: str, filename: str) -> str:
+        """Return the cache key for filename having the content of a git blob."""
+        header = ["blob", __version__, filename, sorted(self.options.items()), blob]
+        return hashlib.sha256(json.dumps(header).encode("utf8")).hexdigest()
+
+    def result_key(self, value: str) -> str:
+        """Return the cache key for a result given as JSON, shared by equal results."""
+        return hashlib.sha256(value.encode("utf8")).hexdigest()
+
+    def verdicts_key(self, filename: str) -> str:
+        """Return the cache key for the function verdicts of filename."""
+        header = ["verdicts", __version__, filename, sorted(self.options.items())]
+        return hashlib.sha256(json.dumps(header).encode("utf8")).hexdigest()
+
+    def _load(self, key: str) -> object:
+        """Return the JSON value stored under key, or None on a miss or error."""
+        import sqlite3
+
+        try:
+            row = self.db.execute(
+                "SELECT value, used FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = int(time.time())
+            # Only write when it matters for eviction, so warm runs just read
+            if now - row[1] > CACHE_TOUCH_SECONDS:
+                self.db.execute(
+                    "UPDATE results SET used = ? WHERE key = ?", (now, key)
+                )
+            return json.loads(row[0])
+        except (OSError, sqlite3.Error, ValueError):
+            return None
+
+    def get(self, key: str) -> tuple[str, list[Finding]] | None:
+        """Return the result stored under key, or None on a miss."""
+        if self.memory is not None and key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        try:
+            output, findings = self._load(key)
+            result = output, [Finding(*finding) for finding in findings]
+        except (ValueError, TypeError):
+            return None
+        self._remember(key, result)
+        return result
+
+    def get_verdicts(self, key: str) -> dict:
+        """Return the function verdicts stored under key, empty on a miss."""
+        if self.memory is not None and key in self.memory:
+            self.memory.move_to_end(key)
+            return dict(self.memory[key])
+        verdicts = self._load(key)
+        return verdicts if isinstance(verdicts, dict) else {}
+
+    def _remember(self, key: str, result: tuple[str, list[Finding]]) -> None:
+        if self.memory is not None:
+            self.memory[key] = result
+            self.memory.move_to_end(key)
+            if len(self.memory) > MEMORY_CACHE_ENTRIES:
+                self.memory.popitem(last=False)
+
+    def put(self, key: str, result: tuple[str, list[Finding]] | dict) -> None:
+        """Store a result or verdicts under key, ignoring errors."""
+        import sqlite3
+
+        self._remember(key, result)
+        value = json.dumps(result)
+        try:
+            self.db.execute(
+                "INSERT INTO results (key, value, size, used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, "
+                "size = excluded.size, used = excluded.used",
+                (key, value, len(value), int(time.time())),
+            )
+        except (OSError, sqlite3.Error):
+            pass
+
+    def prune(self, max_bytes: int | None = None) -> int:
+        """
+        Remove the least recently used entries until the rest take at most max_bytes.
+
+        Args:
+            max_bytes (int | None): Size to prune to, by default self.max_bytes.
+
+        Returns:
+            int: Number of entries removed.
+
+        Raises:
+            OSError: If the cache directory can't be created.
+            sqlite3.Error: If the database can't be opened or written.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        (total,) = self.db.execute("SELECT bytes FROM totals").fetchone()
+        if total <= max_bytes:
+            return 0
+        cursor = self.db.execute(
+            "DELETE FROM results WHERE key IN (SELECT key FROM (SELECT key, "
+            "SUM(size) OVER (ORDER BY used DESC, key) AS kept FROM results) "
+            "WHERE kept > ?)",
+            (max_bytes,),
+        )
+        self.db.execute(
+            "DELETE FROM stats WHERE key NOT IN (SELECT key FROM results)"
+        )
+        return cursor.rowcount
+
+    def evict(self) -> None:
+        """Prune to max_bytes at the end of a run, ignoring errors like put."""
+        import sqlite3
+
+        try:
+            self.prune()
+        except (OSError, sqlite3.Error):
+            pass
+
+    def stats(self) -> dict[str, int]:
+        """Return the number and total size of the entries and stat index rows."""
+        ((entries, size),) = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+        )
+        ((files,),) = self.db.execute("SELECT COUNT(*) FROM stats")
+        database = 0
+        for suffix in ("", "-wal", "-shm"):
+            path = os.path.join(self.directory, CACHE_FILENAME + suffix)
+            if os.path.exists(path):
+                database += os.path.getsize(path)
+        return {
+            "entries": entries,
+            "bytes": size,
+            "indexed files": files,
+            "database bytes": database,
+        }
+
+
+class StatIndex:
+    """
+    The stat and result of each file checked before, to skip files that are unchanged.
+
+    Looking a file up in ResultCache means reading and hashing it. If a file's mtime,
+    size and inode are the same as when it was last checked, its content almost
+    certainly is too, so its result is taken from here without opening the file at
+    all. Files modified within RACY_NANOSECONDS of being checked aren't recorded, like
+    git does for its index. The index is the stats table of the cache database, with
+    rows for each set of options. Each row has the key of the file's result in the
+    results table, which files with equal results share, so results are stored and
+    evicted in one place. The rows are read with their results in batches, only for
+    the files checked unless load() reads them all first, and changes are written in
+    one transaction at the end.
+
+    A file's stat changes whenever it is written, such as in a fresh clone or another
+    worktree, even if its content doesn't. With the git blob IDs of the unmodified
+    files in blobs, from git_blob_ids() run after the index was created, those files
+    are looked up in the cache by blob ID instead, still without opening them.
+    """
+
+    def __init__(self, cache: ResultCache) -> None:
+        header = [__version__, sorted(cache.options.items())]
+        digest = hashlib.sha256(json.dumps(header).encode("utf8")).hexdigest()
+        self.cache = cache
+        self.options = digest[:16]
+        self.cwd = os.getcwd()
+        self.started = time.time_ns()
+        # Path -> [mtime_ns, size, inode, key, result as JSON, last used]
+        self.entries = {}
+        self.changes = {}  # Path -> [mtime_ns, size, inode, key] to write
+        self.results = {}  # Cache key -> result to store
+        self.touched = set()  # Keys of results used long enough ago to update
+        self.blobs = {}  # Real path -> git blob ID
+        self.loaded = False  # Whether entries has every row for the options
+        self.hits = self.blob_hits = 0
+
+    def _key(self, filename: str) -> str:
+        # Not normalized, since findings use the path as given
+        return os.path.join(self.cwd, filename)
+
+    def load(self, filenames: Sequence[str] | None = None) -> None:
+        """
+        Read the rows for these options, for filenames or for every file.
+
+        Reading every row is quicker when walking directories, which check most of
+        the files indexed, while a run over a few files reads just their rows.
+
+        Args:
+            filenames (Sequence[str] | None): Files to read the rows of, by default
+                all of them.
+        """
+        import sqlite3
+
+        query = (
+            "SELECT path, mtime_ns, stats.size, inode, stats.key, value, used "
+            "FROM stats JOIN results ON results.key = stats.key WHERE options = ?"
+        )
+        params = [self.options]
+        if filenames is not None:
+            query += f" AND path IN ({', '.join('?' * len(filenames))})"
+            params += [self._key(filename) for filename in filenames]
+        try:
+            rows = self.cache.db.execute(query, params)
+            self.entries.update((path, entry) for path, *entry in rows)
+        except (OSError, sqlite3.Error):
+            return
+        self.loaded = self.loaded or filenames is None
+
+    def get(
+        self, filename: str, stat: os.stat_result
+    ) -> tuple[str, list[Finding]] | None:
+        """Return the result for filename if its stat is unchanged, or None."""
+        entry = self.entries.get(self._key(filename))
+        current = [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+        if entry is not None and entry[:3] == current:
+            self.hits += 1
+            if time.time() - entry[5] > CACHE_TOUCH_SECONDS:
+                self.touched.add(entry[3])
+            output, findings = json.loads(entry[4])
+            return output, [Finding(*finding) for finding in findings]
+        if not self.blobs:
+            return None
+        blob = self.blobs.get(os.path.realpath(filename))
+        if blob is None:
+            return None
+        result = self.cache.get(self.cache.blob_key(blob, filename))
+        if result is not None:
+            self.blob_hits += 1
+            self.put(filename, stat, result, blob=False)
+        return result
+
+    def put(
+        self,
+        filename: str,
+        stat: os.stat_result,
+        result: tuple[str, list[Finding]],
+        blob: bool = True,
+    ) -> None:
+        """
+        Record the result for filename, which had stat when it was read.
+
+        Args:
+            filename (str): Path of the file.
+            stat (os.stat_result): Stat of the file before it was read.
+            result (tuple[str, list[Finding]]): Result of checking the file.
+            blob (bool): Whether to also store the result under its git blob ID.
+        """
+        # Files modified since git was asked could differ from their blob too
+        if stat.st_mtime_ns > self.started - RACY_NANOSECONDS:
+            return
+        if blob and self.blobs:
+            blob_id = self.blobs.get(os.path.realpath(filename))
+            if blob_id is not None:
+                self.results[self.cache.blob_key(blob_id, filename)] = result
+        path = self._key(filename)
+        key = self.cache.result_key(json.dumps(result))
+        entry = [stat.st_mtime_ns, stat.st_size, stat.st_ino, key]
+        if self.entries.get(path, [])[:4] != entry:
+            self.changes[path] = entry
+            self.results[key] = result
+
+    def save(self) -> None:
+        """Write the changes to the index, ignoring errors like ResultCache.put."""
+        import sqlite3
+
+        if not self.changes and not self.results and not self.touched:
+            return
+        rows = [(self.options, path, *row) for path, row in self.changes.items()]
+        now = int(time.time())
+        try:
+            db = self.cache.db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for key, result in self.results.items():
+                    self.cache.put(key, result)
+                db.executemany(
+                    "INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT "
+                    "(options, path) DO UPDATE SET mtime_ns = excluded.mtime_ns, "
+                    "size = excluded.size, inode = excluded.inode, "
+                    "key = excluded.key",
+                    rows,
+                )
+                # Results only read through here would otherwise look unused
+                db.executemany(
+                    "UPDATE results SET used = ? WHERE key = ?",
+                    [(now, key) for key in self.touched],
+                )
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        except (OSError, sqlite3.Error):
+            pass
+        self.changes.clear()
+        self.results.clear()
+        self.touched.clear()
+
+    def check_changed(
+        self, work: Iterable[tuple], check: Callable, paranoid: bool = False
+    ) -> Iterator[tuple]:
+        """
+        Yield check_file results for work in order, taking unchanged files' from here.
+
+        Args:
+            work (Iterable[tuple]): Arguments for check_file, starting with the path.
+            check (Callable): Maps an iterable of such arguments to the results of
+                check_file for each, in order, e.g. by sending them to workers.
+            paranoid (bool): Whether to check every file, only updating the index.
+
+        Yields:
+            tuple: The result of check_file for each file, with no Profile for the
+                files that were unchanged.
+        """
+        work = iter(work)
+        queue = collections.deque()  # (path, stat, result if unchanged)
+
+        def changed() -> Iterator[tuple]:
+            batches = iter(lambda: list(itertools.islice(work, STAT_BATCH_FILES)), [])
+            for batch in batches:
+                if not self.loaded:
+                    self.load([args[0] for args in batch])
+                for args in batch:
+                    try:
+                        stat = os.stat(args[0])
+                    except OSError:
+                        stat = None
+                    result = None
+                    if stat is not None and not paranoid:
+                        result = self.get(args[0], stat)
+                    queue.append((args[0], stat, result))
+                    if result is None:
+                        yield args
+
+        # check reads ahead of what it yields, so the queue holds the files in between
+        for output, findings, file_profile in check(changed()):
+            while queue[0][2] is not None:
+                yield (*queue.popleft()[2], None)
+            filename, stat, _ = queue.popleft()
+            # A timeout depends on the machine, not the file, so isn't worth keeping
+            timed_out = any(finding.rule == "timeout" for finding in findings)
+            if stat is not None and not timed_out:
+                self.put(filename, stat, (output, findings))
+            yield output, findings, file_profile
+        for _, _, result in queue:
+            yield (*result, None)
+
+
+def check_file(
+    filename: str,
+    lines: list[tuple[int, int]] | None = None,
+    cache: ResultCache | None = None,
+    engine: str = "scan",
+    timeout: float | None = None,
+    profile: bool = False,
+    verbosity: int = 0,
+) -> tuple[str, list[Finding], Profile | None]:
+    """
+    Run check_docstrings on a single file, collecting its progress and findings.
+
+    This is the unit of work handed to worker processes.
+
+    Args:
+        filename (str): Path to the file to check.
+        lines (list[tuple[int, int]] | None): If given, only check functions whose
+            signature or docstring overlaps one of these sorted ranges of lines.
+        cache (ResultCache | None): Cache to look the result up in and store it to.
+        engine (str): Name of the engine in ENGINES used to find functions.
+        timeout (float | None): Seconds after which to stop checking the file.
+        profile (bool): Whether to record where the time was spent.
+        verbosity (int): Level up to which to keep progress messages.
+
+    Returns:
+        tuple: The progress messages, the findings for the file and the Profile for
+            the file if profile is True.
+    """
+    file_profile = Profile() if profile else None
+    memos_before = memo_counts() if profile else None
+    start = time.perf_counter()
+    output, findings = check_file_with_cache(
+        filename, lines, cache, engine, timeout, file_profile, verbosity
+    )
+    if file_profile is not None:
+        entry = (time.perf_counter() - start, filename)
+        file_profile.add_slowest(file_profile.files, entry)
+        # The memos live as long as the worker process, so record what this file added
+        file_profile.counts.update(memo_counts() - memos_before)
+    return output, findings, file_profile
+
+
+def check_file_with_cache(
+    filename: str,
+    lines: list[tuple[int, int]] | None,
+    cache: ResultCache | None,
+    engine: str,
+    timeout: float | None,
+    profile: Profile | None,
+    verbosity: int = 0,
+) -> tuple[str, list[Finding]]:
+    """
+    Look up the result for a file in the cache, checking the file on a miss.
+
+    Args:
+        filename (str): Path to the file to check.
+        lines (list[tuple[int, int]] | None): If given, only check functions whose
+            signature or docstring overlaps one of these sorted ranges of lines.
+        cache (ResultCache | None): Cache to look the result up in and store it to.
+        engine (str): Name of the engine in ENGINES used to find functions.
+        timeout (float | None): Seconds after which to stop checking the file.
+        profile (Profile | None): Profile to record the time spent in to.
+        verbosity (int): Level up to which to keep progress messages.
+
+    Returns:
+        tuple: The progress messages and the findings for the file.
+    """
+    phase = phase_timer(profile)
+    log = ProgressLog(verbosity) if verbosity else NO_LOG
+    try:
+        with phase("read"):
+            content = read_source(filename, engine == "scan")
+    except OSError:
+        # check_docstrings reports the error
+        findings = check_docstrings(filename, engine, timeout, lines, profile, log)
+        return log.getvalue(), findings
+
+    try:
+        with phase("prefilter"):
+            skip = filename.endswith(".py") and not may_have_findings(content, engine)
+        if skip:
+            if profile is not None:
+                counts = {"files skipped": 1, "bytes skipped": len(content)}
+                profile.counts.update(counts)
+            log.log(DETAIL, "Skipped %s, it has no functions with docstrings", filename)
+            return log.getvalue(), []
+
+        key = None
+        if cache is not None:
+            with phase("cache"):
+                key = cache.key(content, filename)
+                result = cache.get(key)
+            if result is not None:
+                return result
+
+        # Progress messages come from checking, so verbose runs check every function
+        verdicts_key = verdicts = None
+        if cache is not None and not verbosity and len(content) >= VERDICTS_MIN_SIZE:
+            with phase("cache"):
+                verdicts_key = cache.verdicts_key(filename)
+                verdicts = cache.get_verdicts(verdicts_key)
+
+        if profile is not None:
+            profile.counts.update({"files checked": 1, "bytes checked": len(content)})
+        try:
+            with phase("decode"):
+                if not isinstance(content, bytes) and content.find(b"\r") == -1:
+                    check_utf8(content)
+                    code = content  # The scan engine decodes only what it finds
+                else:
+                    code = decode_source(content)
+            findings = check_code(
+                code, filename, engine, timeout, lines, profile, log, verdicts
+            )
+        except UnicodeDecodeError as exc:
+            findings = [file_error_finding(filename, exc)]
+        result = (log.getvalue(), findings)
+    finally:
+        if not isinstance(content, bytes):
+            content.close()  # Memory-mapped
+
+    if verdicts:
+        with phase("cache"):
+            cache.put(verdicts_key, verdicts)
+    # A timeout depends on the machine, not the content, so isn't worth remembering
+    if key is not None and not any(finding.rule == "timeout" for finding in findings):
+        with phase("cache"):
+            cache.put(key, result)
+    return result
+
+
+def check_source(
+    code: str,
+    filename: str = "<string>",
+    engine: str = "scan",
+    timeout: float | None = None,
+) -> list[Finding]:
+    """
+    Check the functions in a string of Python source code, for use as a library.
+
+    Nothing is printed. The code is checked whatever filename is, so an editor can
+    check a buffer that hasn't been saved.
+
+    Args:
+        code (str): Python source code.
+        filename (str): Name to give the code in findings.
+        engine (str): Name of the engine in ENGINES used to find functions.
+        timeout (float | None): Seconds after which to stop checking the code.
+
+    Returns:
+        list: Findings for every problem in the code, empty if there are none.
+    """
+    return check_functions(code, filename, engine, timeout)
+
+
+def check_paths(
+    paths: Iterable[str],
+    engine: str = "scan",
+    timeout: float | None = None,
+    include: Sequence[str] = DEFAULT_INCLUDE,
+    exclude: Sequence[str] = (),
+    gitignore: bool = True,
+    cache_dir: str | None = None,
+) -> Iterator[Finding]:
+    """
+    Check files and the files found in directories, for use as a library.
+
+    Files are checked in this process one at a time as findings are asked for, and
+    nothing is printed. Problems with the files themselves, like a file not existing,
+    are findings too.
+
+    Args:
+        paths (Iterable[str]): Files to check and directories to search for them.
+        engine (str): Name of the engine in ENGINES used to find functions.
+        timeout (float | None): Seconds after which to stop checking a file.
+        include (Sequence[str]): Globs a file name in a directory must match one of.
+        exclude (Sequence[str]): Globs for names and relative paths in directories
+            to skip, on top of DEFAULT_EXCLUDE.
+        gitignore (bool): Whether to skip files and directories ignored by git.
+        cache_dir (str | None): Directory to cache results in, shared with the
+            command line. By default nothing is cached.
+
+    Yields:
+        Finding: Each problem found, file by file in the order of paths.
+    """
+    options = {"engine": engine, "verbosity": 0}
+    cache = None if cache_dir is None else ResultCache(cache_dir, options)
+    filenames = expand_paths(
+        list(paths), include, DEFAULT_EXCLUDE + tuple(exclude), gitignore
+    )
+    try:
+        for filename in filenames:
+            _, findings, _ = check_file(filename, None, cache, engine, timeout)
+            yield from findings
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def shard_key(filename: str) -> str:
+    """Return the form of a path that is hashed and looked up in timing files."""
+    return os.path.normpath(filename).replace(os.sep, "/")
+
+
+def shard_of(filename: str, num_shards: int) -> int:
+    """Return the zero-based shard a file belongs to, the same on every machine."""
+    digest = hashlib.blake2b(shard_key(filename).encode("utf8"), digest_size=8)
+    return int.from_bytes(digest.digest(), "big") % num_shards
+
+
+def read_timings(paths: Sequence[str]) -> dict[str, dict]:
+    """
+    Read timing files saved by --save-timings, later files taking precedence.
+
+    Args:
+        paths (Sequence[str]): Timing files, such as one from each shard of a run.
+
+    Returns:
+        dict: The seconds spent checking each file and its size in bytes, by path.
+    """
+    timings = {}
+    for path in paths:
+        with open(path, encoding="utf8") as file:
+            timings.update(json.load(file))
+    return timings
+
+
+def shard_files(
+    filenames: Iterable[str], shard: tuple[int, int], timings: dict | None = None
+) -> Iterator[str]:
+    """
+    Yield the files that belong to one of several shards, in their original order.
+
+    Without timings each file goes to a shard chosen by a hash of its path, so files
+    are yielded as they are found. With timings the files are balanced by the time
+    they took to check last time: each file, slowest first, goes to the shard with
+    the least work so far. Files that weren't timed are estimated from their size.
+    Either way the result only depends on the paths and timings, so every machine
+    computes the same partition and each file is in exactly one shard.
+
+    Args:
+        filenames (Iterable[str]): Paths of all the files to check.
+        shard (tuple[int, int]): Zero-based index of the shard, and number of shards.
+        timings (dict | None): Result of read_timings for a previous run.
+
+    Yields:
+        str: Path of each file in the shard.
+    """
+    index, num_shards = shard
+    if not timings:
+        for filename in filenames:
+            if shard_of(filename, num_shards) == index:
+                yield filename
+        return
+
+    filenames = list(filenames)
+    timed = timings.values()
+    total_bytes = sum(timing["bytes"] for timing in timed)
+    rate = sum(timing["seconds"] for timing in timed) / max(total_bytes, 1)
+    weights = {}
+    for filename in filenames:
+        timing = timings.get(shard_key(filename))
+        if timing is not None:
+            seconds = timing["seconds"]
+        else:
+            try:
+                seconds = os.path.getsize(filename) * rate
+            except OSError:
+                seconds = 0.0
+        # A floor, so files that took no time are still spread across the shards
+        weights[filename] = max(seconds, 1e-6)
+
+    loads = [(0.0, shard_index) for shard_index in range(num_shards)]
+    mine = set()
+    for filename in sorted(filenames, key=lambda name: (-weights[name], name)):
+        load, shard_index = loads[0]
+        heapq.heapreplace(loads, (load + weights[filename], shard_index))
+        if shard_index == index:
+            mine.add(filename)
+    for filename in filenames:
+        if filename in mine:
+            yield filename
+
+
+def save_timings(path: str, timings: dict[str, float]) -> None:
+    """Save the seconds spent checking each file, with its size, for --timings."""
+    saved = {}
+    for filename, seconds in timings.items():
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            size = 0
+        saved[shard_key(filename)] = {"seconds": round(seconds, 6), "bytes": size}
+    with open(path, "w", encoding="utf8") as file:
+        json.dump(saved, file, indent=1, sort_keys=True)
+
+
+def shard_spec(value: str) -> tuple[int, int]:
+    """Argparse type for --shard K/N, returning a zero-based index and the count."""
+    import argparse
+
+    index, _, count = value.partition("/")
+    try:
+        shard = int(index), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be K/N, got {value}") from None
+    if not 1 <= shard[0] <= shard[1]:
+        raise argparse.ArgumentTypeError(f"K must be from 1 to N, got {value}")
+    return shard[0] - 1, shard[1]
+
+
+SIZE_SUFFIXES = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+
+def byte_size(value: str) -> int:
+    """Argparse type for sizes in bytes, optionally with a K, M or G suffix."""
+    import argparse
+
+    number, suffix = value.upper(), ""
+    if number[-1:] in SIZE_SUFFIXES:
+        number, suffix = number[:-1], number[-1]
+    try:
+        size = int(float(number) * SIZE_SUFFIXES[suffix])
+    except ValueError:
+        message = f"must be a size like 256M, got {value}"
+        raise argparse.ArgumentTypeError(message) from None
+    if size < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative, got {value}")
+    return size
+
+
+def format_size(size: int) -> str:
+    """Return a size in bytes in the largest unit it has at least one of."""
+    for suffix in ("G", "M", "K"):
+        if size >= SIZE_SUFFIXES[suffix]:
+            return f"{size / SIZE_SUFFIXES[suffix]:.1f} {suffix}B"
+    return f"{size} bytes"
+
+
+def positive_int(value: str) -> int:
+    """Argparse type for options that need an integer of at least 1."""
+    import argparse
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def build_parser() -> "argparse.ArgumentParser":
+    """Build the command line parser."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Check docstrings and type hints in Python files."
+    )
+    parser.add_argument(
+        "filenames",
+        nargs="*",
+        help="Python files to check, and directories to search for them recursively",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes to check files with (default: CPU count)",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="Check files in directories whose name matches GLOB (default: *.py)",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help=(
+            "Skip files and directories in directories whose name or relative path "
+            f"matches GLOB, on top of {', '.join(DEFAULT_EXCLUDE)}"
+        ),
+    )
+    parser.add_argument(
+        "--no-gitignore",
+        action="store_true",
+        help="Don't skip files in directories that git ignores",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=sorted(ENGINES),
+        default="scan",
+        help="How to find functions and their docstrings (default: scan)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help=(
+            "Seconds to spend on a file before reporting a timeout, 0 for no limit "
+            f"(default: {DEFAULT_TIMEOUT:g})"
+        ),
+    )
+    parser.add_argument(
+        "--diff-only",
+        action="store_true",
+        help="Only check functions whose signature or docstring is in the staged diff",
+    )
+    parser.add_argument(
+        "--since",
+        metavar="REV",
+        help="With --diff-only, use the diff from REV to the working tree instead",
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(FORMATS),
+        default="text",
+        help="How to print findings (default: text)",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help=(
+            "Also print each function as it is checked, and with -vv checks that are "
+            "skipped (to stderr unless --format is text)"
+        ),
+    )
+    parser.add_argument(
+        "--shard",
+        type=shard_spec,
+        metavar="K/N",
+        help="Only check the files in shard K of N, for splitting a run across "
+        "machines. Combine their --format jsonl output with the merge subcommand",
+    )
+    parser.add_argument(
+        "--timings",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="Balance --shard by the times in FILE, saved by --save-timings",
+    )
+    parser.add_argument(
+        "--save-timings",
+        metavar="FILE",
+        help="Save the time spent checking each file to FILE, for --timings",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir(),
+        help=f"Directory to cache results in (default: {default_cache_dir()})",
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        type=byte_size,
+        default=DEFAULT_CACHE_MAX_SIZE,
+        metavar="SIZE",
+        help="Evict the least recently used results once the cache is bigger than "
+        f"SIZE, like 64M (default: {format_size(DEFAULT_CACHE_MAX_SIZE)})",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Check every file, ignoring the cache"
+    )
+    parser.add_argument(
+        "--paranoid",
+        action="store_true",
+        help="Look every file up in the cache by its content, even if its mtime, size "
+        "and inode are the same as when it was last checked",
+    )
+    parser.add_argument(
+        "--git-objects",
+        action="store_true",
+        help="Look files tracked by git up in the cache by their blob ID, so files "
+        "that are unchanged in git aren't opened even in a fresh clone or worktree",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent in each phase and the slowest files and functions",
+    )
+    parser.add_argument(
+        "--profile-dump",
+        metavar="FILE",
+        help="Also save cProfile stats to FILE, checking files in this process",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running, checking files again as they change and printing what "
+        "findings are new or fixed",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Serve checks to check_docstrings_client.py over a Unix socket",
+    )
+    parser.add_argument(
+        "--socket",
+        help="Socket for --daemon to listen on (default: $CHECK_DOCSTRINGS_SOCKET, "
+        "or one for the current user in $XDG_RUNTIME_DIR or $TMPDIR)",
+    )
+    return parser
+
+
+def check_chunk(function: Callable, chunk: list[tuple], cwd: str) -> list:
+    """
+    Call function with each tuple of arguments in chunk, in a worker process.
+
+    Args:
+        function (Callable): Function to call.
+        chunk (list[tuple]): Arguments for each call.
+        cwd (str): Directory relative paths are relative to. Workers outlive the
+            daemon's requests, which each come from a client's own directory.
+
+    Returns:
+        list: The result of each call.
+    """
+    if os.getcwd() != cwd:
+        os.chdir(cwd)
+    return [function(*args) for args in chunk]
+
+
+def imap_ordered(
+    executor: "ProcessPoolExecutor",
+    function: Callable,
+    iterable: Iterable[tuple],
+    chunksize: int,
+    window: int,
+) -> Iterator:
+    """
+    Like executor.map, but take arguments from iterable only as workers need them.
+
+    executor.map submits everything before returning, so nothing would be reported
+    until a directory walk had finished. Here at most window chunks of chunksize calls
+    are in flight, and results are yielded in order as soon as they are ready.
+
+    Args:
+        executor (ProcessPoolExecutor): Pool to run the calls in.
+        function (Callable): Picklable function to call.
+        iterable (Iterable[tuple]): Arguments for each call.
+        chunksize (int): Number of calls to send to a worker at once.
+        window (int): Maximum number of chunks submitted but not yet yielded.
+
+    Yields:
+        object: The result of each call, in the order of iterable.
+    """
+    iterator = iter(iterable)
+    pending = collections.deque()
+    cwd = os.getcwd()
+    try:
+        while chunk := list(itertools.islice(iterator, chunksize)):
+            pending.append(executor.submit(check_chunk, function, chunk, cwd))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class TextFormatter:
+    """Print findings as path:line: message lines, followed by a count."""
+
+    def __init__(self, stream: io.TextIOBase) -> None:
+        self.stream = stream
+
+    def begin(self) -> None:
+        """Start the output."""
+
+    def write(self, finding: Finding) -> None:
+        """Print a finding."""
+        self.stream.write(f"{finding}\n")
+
+    def end(self, num_findings: int) -> None:
+        """Finish the output once all findings have been written."""
+        if num_findings:
+            self.stream.write(f"Found {num_findings} problem(s).\n")
+
+
+class JsonLinesFormatter(TextFormatter):
+    """Print each finding as a JSON object on its own line."""
+
+    def write(self, finding: Finding) -> None:
+        """Print a finding."""
+        self.stream.write(json.dumps(finding._asdict()) + "\n")
+
+    def end(self, num_findings: int) -> None:
+        """Finish the output once all findings have been written."""
+
+
+class SarifFormatter(TextFormatter):
+    """
+    Print findings as a SARIF 2.1.0 log, for code scanning tools.
+
+    The log is a single JSON document, but it is written as findings come in rather
+    than built up in memory: the header, then each result, then the closing brackets.
+    """
+
+    def begin(self) -> None:
+        """Print the tool description and open the results array."""
+        driver = {
+            "name": "check_docstrings",
+            "version": __version__,
+            "rules": [
+                {"id": rule, "shortDescription": {"text": description}}
+                for rule, description in RULES.items()
+            ],
+        }
+        header = json.dumps(
+            {
+                "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+                "version": "2.1.0",
+                "runs": [{"tool": {"driver": driver}, "results": []}],
+            }
+        )
+        # Leave the results array open
+        self.stream.write(header[: -len("]}]}")] + "\n")
+        self.separator = ""
+
+    def write(self, finding: Finding) -> None:
+        """Print a finding as a SARIF result."""
+        import pathlib
+        import urllib.parse
+
+        if os.path.isabs(finding.filename):
+            uri = pathlib.Path(finding.filename).as_uri()
+        else:
+            uri = urllib.parse.quote(pathlib.Path(finding.filename).as_posix())
+        location = {"artifactLocation": {"uri": uri}}
+        if finding.line:
+            location["region"] = {"startLine": finding.line}
+        result = {
+            "ruleId": finding.rule,
+            "level": "error",
+            "message": {"text": finding.message},
+            "locations": [{"physicalLocation": location}],
+        }
+        self.stream.write(self.separator + json.dumps(result))
+        self.separator = ",\n"
+
+    def end(self, num_findings: int) -> None:
+        """Close the results array and the log."""
+        self.stream.write("\n]}]}\n")
+
+
+FORMATS = {
+    "text": TextFormatter,
+    "jsonl": JsonLinesFormatter,
+    "sarif": SarifFormatter,
+}
+
+
+class BufferedWriter(io.TextIOBase):
+    """Text stream that collects what is written and writes it out in large chunks."""
+
+    def __init__(self, stream: io.TextIOBase, size: int = OUTPUT_BUFFER_SIZE) -> None:
+        super().__init__()
+        self.stream = stream
+        self.limit = size
+        self.buffer = []
+        self.size = 0
+
+    def write(self, text: str) -> int:
+        """Buffer text."""
+        self.buffer.append(text)
+        self.size += len(text)
+        return len(text)
+
+    def flush(self, force: bool = True) -> None:
+        """Write everything buffered, or only once it is large if force is False."""
+        if self.buffer and (force or self.size >= self.limit):
+            self.stream.write("".join(self.buffer))
+            self.buffer.clear()
+            self.size = 0
+            self.stream.flush()
+
+
+class Reporter:
+    """
+    Write the progress messages and findings for each file as its result comes in.
+
+    Output is buffered and written in large chunks between files, rather than with a
+    write per line. On a terminal it is written after every file, so progress shows.
+    """
+
+    def __init__(
+        self, output_format: str, stdout: io.TextIOBase, stderr: io.TextIOBase
+    ) -> None:
+        self.out = BufferedWriter(stdout)
+        self.progress = self.out if output_format == "text" else BufferedWriter(stderr)
+        self.formatter = FORMATS[output_format](self.out)
+        self.interactive = stdout.isatty()
+        self.num_findings = 0
+
+    def begin(self) -> None:
+        """Start the output."""
+        self.formatter.begin()
+
+    def file(self, output: str, findings: list[Finding]) -> None:
+        """Report the progress messages and findings for a file."""
+        if output:
+            self.progress.write(output)
+        for finding in findings:
+            self.formatter.write(finding)
+        self.num_findings += len(findings)
+        self.flush(force=self.interactive)
+
+    def flush(self, force: bool = True) -> None:
+        """Write out the buffered output, or only once it is large if force is False."""
+        self.progress.flush(force)
+        self.out.flush(force)
+
+    def end(self) -> None:
+        """Finish the output once every file has been reported, and write it out."""
+        self.formatter.end(self.num_findings)
+        self.flush()
+
+
+def run(
+    args: "argparse.Namespace",
+    executor: "ProcessPoolExecutor | None" = None,
+    memory: collections.OrderedDict | None = None,
+) -> int:
+    """
+    Check the files given on the command line and print the findings.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+        executor (ProcessPoolExecutor | None): Long-lived pool to check files with
+            instead of starting one for this run. Small runs are checked in-process.
+        memory (collections.OrderedDict | None): In-memory layer for the result
+            cache that outlives this run.
+
+    Returns:
+        int: Exit code, 1 if there were any findings and 0 otherwise.
+    """
+    if len(args.filenames) == 0:
+        print("No files to check.")
+        return 1
+
+    # Directories are walked lazily, so checking starts with the first file found
+    filenames = expand_paths(
+        args.filenames,
+        args.include or DEFAULT_INCLUDE,
+        DEFAULT_EXCLUDE + tuple(args.exclude),
+        not args.no_gitignore,
+    )
+    if args.shard is not None:
+        try:
+            timings = read_timings(args.timings)
+        except (OSError, ValueError) as exc:
+            print(f"Error: Could not read the timings: {exc}")
+            return 1
+        filenames = shard_files(filenames, args.shard, timings)
+    if args.diff_only or args.since is not None:
+        try:
+            changed = changed_lines(args.since)
+        except RuntimeError as exc:
+            print(f"Error: Could not get the diff from git: {exc}")
+            return 1
+        # Both sides are real paths, so symlinks and the cwd don't hide changes
+        work = (
+            (fname, changed[path])
+            for fname, path in ((fname, os.path.realpath(fname)) for fname in filenames)
+            if path in changed
+        )
+    else:
+        work = ((fname, None) for fname in filenames)
+
+    # Results only cover part of a file when checking a diff, so aren't cached
+    options = {"engine": args.engine, "verbosity": args.verbose}
+    if args.no_cache or args.diff_only or args.since is not None:
+        cache = None
+    else:
+        cache = ResultCache(args.cache_dir, options, memory, args.cache_max_size)
+    profile = Profile() if args.profile or args.profile_dump else None
+    timings = {} if args.save_timings else None
+    worker = functools.partial(
+        check_file,
+        cache=cache,
+        timeout=args.timeout,
+        profile=profile is not None or timings is not None,
+        **options,
+    )
+
+    # Results are yielded in input order whatever order the workers finish in,
+    # so the output is the same as a serial run.
+    jobs = args.jobs
+    num_files = None
+    if not any(os.path.isdir(path) for path in args.filenames):
+        num_files = len(args.filenames)
+        jobs = min(jobs, num_files)
+    own_executor = executor is None
+    if executor is not None and num_files is not None:
+        if num_files <= DAEMON_INPROCESS_FILES:
+            jobs = 1
+    profiler = None
+    if args.profile_dump:
+        jobs = 1  # cProfile only sees this process
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if jobs > 1:
+        if own_executor:
+            from concurrent.futures import ProcessPoolExecutor
+
+            executor = ProcessPoolExecutor(max_workers=jobs)
+        chunksize = 16 if num_files is None else min(32, num_files // (jobs * 4))
+        check = functools.partial(
+            imap_ordered, executor, worker, chunksize=max(1, chunksize), window=jobs * 4
+        )
+    else:
+        check = functools.partial(itertools.starmap, worker)
+    index = None
+    # Unchanged files would be skipped without being timed, leaving them out of the
+    # saved timings, so the stat index is only used when timings aren't saved
+    if cache is not None and timings is None:
+        index = StatIndex(cache)
+        if num_files is None:
+            index.load()
+        if args.git_objects:
+            try:
+                index.blobs = git_blob_ids(args.filenames)
+            except RuntimeError as exc:
+                sys.stderr.write(f"Warning: Not using git blob IDs: {exc}\n")
+        results = index.check_changed(work, check, args.paranoid)
+    else:
+        results = check(work)
+
+    # Findings are written as each file's results come in, not collected first
+    reporter = Reporter(args.format, sys.stdout, sys.stderr)
+    reporter.begin()
+    try:
+        for output, findings, file_profile in results:
+            with phase_timer(file_profile)("report"):
+                reporter.file(output, findings)
+            if file_profile is None:
+                continue  # Unchanged according to the stat index
+            if timings is not None:
+                ((wall, filename),) = file_profile.files
+                timings[filename] = wall
+            if profile is not None:
+                profile.merge(file_profile)
+    finally:
+        reporter.flush()
+        if jobs > 1 and own_executor:
+            executor.shutdown(cancel_futures=True)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile_dump)
+
+    reporter.end()
+    if index is not None:
+        index.save()
+    if cache is not None:
+        cache.evict()
+        cache.close()
+    if profile is not None:
+        if index is not None:
+            profile.counts["files unchanged"] += index.hits
+            profile.counts["files unchanged in git"] += index.blob_hits
+        sys.stderr.write(profile.report())
+    if timings is not None:
+        save_timings(args.save_timings, timings)
+    return 1 if reporter.num_findings else 0
+
+
+def build_merge_parser() -> "argparse.ArgumentParser":
+    """Build the command line parser for the merge subcommand."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="check_docstrings.py merge",
+        description="Combine the --format jsonl output of each --shard into one "
+        "report, exiting with 1 if there were any findings.",
+    )
+    parser.add_argument(
+        "results", nargs="+", help="Files with the output of each shard"
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(FORMATS),
+        default="text",
+        help="How to print findings (default: text)",
+    )
+    return parser
+
+
+def merge(argv: Sequence[str]) -> int:
+    """
+    Print the findings from the output of several shards as if from a single run.
+
+    Args:
+        argv (Sequence[str]): Command line arguments after the subcommand.
+
+    Returns:
+        int: Exit code, 1 if there were any findings or a file couldn't be read.
+    """
+    args = build_merge_parser().parse_args(argv)
+    findings = []
+    for path in args.results:
+        try:
+            with open(path, encoding="utf8") as file:
+                for line in file:
+                    if line.strip():
+                        finding = json.loads(line)
+                        findings.append(Finding(*map(finding.get, Finding._fields)))
+        except (OSError, ValueError) as exc:
+            print(f"Error: Could not read the results in {path}: {exc}")
+            return 1
+
+    # Shards finish in any order, so sort by file; a file's findings stay in order
+    findings.sort(key=lambda finding: finding.filename)
+    reporter = Reporter(args.format, sys.stdout, sys.stderr)
+    reporter.begin()
+    for _, group in itertools.groupby(findings, key=lambda finding: finding.filename):
+        reporter.file("", list(group))
+    reporter.end()
+    return 1 if reporter.num_findings else 0
+
+
+def build_cache_parser() -> "argparse.ArgumentParser":
+    """Build the command line parser for the cache subcommand."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="check_docstrings.py cache",
+        description="Show or shrink the cache of results shared by runs.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Print the number and size of cached results")
+    prune = commands.add_parser(
+        "prune",
+        help="Evict the least recently used results and the stat index entries of "
+        "files that no longer exist, then compact the database",
+    )
+    prune.add_argument(
+        "--max-size",
+        type=byte_size,
+        default=DEFAULT_CACHE_MAX_SIZE,
+        metavar="SIZE",
+        help="Size to evict results down to, like 64M or 0 to empty the cache "
+        f"(default: {format_size(DEFAULT_CACHE_MAX_SIZE)})",
+    )
+    for command in commands.choices.values():
+        command.add_argument(
+            "--cache-dir",
+            default=default_cache_dir(),
+            help=f"Directory of the cache (default: {default_cache_dir()})",
+        )
+    return parser
+
+
+def cache_command(argv: Sequence[str]) -> int:
+    """
+    Print statistics about the cache, or prune it.
+
+    Args:
+        argv (Sequence[str]): Command line arguments after the subcommand.
+
+    Returns:
+        int: Exit code, 1 if the cache couldn't be read or written.
+    """
+    import sqlite3
+
+    args = build_cache_parser().parse_args(argv)
+    if not os.path.exists(os.path.join(args.cache_dir, CACHE_FILENAME)):
+        print(f"No cache in {args.cache_dir}")
+        return 0
+    cache = ResultCache(args.cache_dir)
+    try:
+        if args.command == "prune":
+            removed = cache.prune(args.max_size)
+            rows = cache.db.execute("SELECT path FROM stats").fetchall()
+            deleted = [row for row in rows if not os.path.exists(row[0])]
+            cache.db.executemany("DELETE FROM stats WHERE path = ?", deleted)
+            # Give the freed pages back to the filesystem
+            cache.db.execute("VACUUM")
+            cache.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            print(
+                f"Evicted {removed} results and forgot {len(deleted)} deleted files"
+            )
+        stats = cache.stats()
+    except (OSError, sqlite3.Error) as exc:
+        print(f"Error: Could not use the cache in {args.cache_dir}: {exc}")
+        return 1
+    finally:
+        cache.close()
+    print(
+        f"{stats['entries']} results taking {format_size(stats['bytes'])}, "
+        f"{stats['indexed files']} files in the stat index, "
+        f"{format_size(stats['database bytes'])} on disk"
+    )
+    return 0
+
+
+SUBCOMMANDS = {"merge": merge, "cache": cache_command}
+
+
+class PollingWatcher:
+    """Find changed files by listing them and comparing their mtimes and sizes."""
+
+    def __init__(
+        self, list_files: Callable[[], list[str]], interval: float = POLL_SECONDS
+    ) -> None:
+        self.list_files = list_files
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self) -> dict[str, tuple[int, int]]:
+        """Return the modification time and size of each file, keyed by path."""
+        snapshot = {}
+        for path in self.list_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[os.path.normpath(path)] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def watch(self, directories: Iterable[str]) -> None:
+        """Nothing to do, as every file is listed again each time."""
+
+    def wait(self, timeout: float | None) -> tuple[set[str], bool]:
+        """
+        Wait until a file has changed, been added or removed, or timeout has passed.
+
+        Args:
+            timeout (float | None): Seconds to wait for, or None to wait until
+                something changes.
+
+        Returns:
+            tuple: The paths that changed, and whether files were added or removed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = max(0.0, min(delay, deadline - time.monotonic()))
+            time.sleep(delay)
+            snapshot = self.take_snapshot()
+            changed = {
+                path
+                for path in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(path) != self.snapshot.get(path)
+            }
+            added_or_removed = snapshot.keys() != self.snapshot.keys()
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed, added_or_removed
+
+    def close(self) -> None:
+        """Stop watching."""
+
+
+class InotifyWatcher:
+    """
+    Find changed files with Linux inotify, called through ctypes.
+
+    Each directory has to be watched separately. Events for files that are written
+    and closed, moved, created or deleted in them are collected.
+    """
+
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    MASK |= IN_DELETE_SELF | IN_MOVE_SELF
+    EVENT = struct.Struct("iIII")  # wd, mask, cookie, len, then the name
+
+    def __init__(self, directories: Iterable[str]) -> None:
+        """
+        Start watching directories.
+
+        Args:
+            directories (Iterable[str]): Directories to watch, without recursing.
+
+        Raises:
+            OSError: If inotify isn't available, e.g. not on Linux.
+        """
+        import ctypes
+
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            self.inotify_add_watch = libc.inotify_add_watch
+            init = libc.inotify_init1
+        except (OSError, AttributeError) as exc:
+            raise OSError("inotify is not available") from exc
+        self.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd == -1:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.directories = {}  # Watch descriptor -> path of directory
+        self.watch(directories)
+
+    def watch(self, directories: Iterable[str]) -> None:
+        """Also watch the directories that aren't already watched."""
+        watched = {os.path.normpath(path) for path in self.directories.values()}
+        for directory in directories:
+            if os.path.normpath(directory) in watched:
+                continue
+            wd = self.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+            if wd != -1:  # It may have been removed already
+                self.directories[wd] = directory
+
+    def wait(self, timeout: float | None) -> tuple[set[str], bool]:
+        """
+        Wait until a file has changed, been added or removed, or timeout has passed.
+
+        Args:
+            timeout (float | None): Seconds to wait for, or None to wait until
+                something changes.
+
+        Returns:
+            tuple: The paths that changed, and whether directories changed, so files
+                may have been added or removed other than those paths.
+        """
+        changed = set()
+        restructured = False
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed, restructured
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed, restructured
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_IGNORED:
+                self.directories.pop(wd, None)
+            if mask & (self.IN_Q_OVERFLOW | self.IN_ISDIR):
+                restructured = True
+            directory = self.directories.get(wd)
+            if directory is not None and name:
+                path = os.path.join(directory, os.fsdecode(name))
+                changed.add(os.path.normpath(path))
+        return changed, restructured
+
+    def close(self) -> None:
+        """Stop watching."""
+        os.close(self.fd)
+
+
+def watch_directories(
+    paths: Sequence[str], exclude: Sequence[str], gitignore: bool
+) -> list[str]:
+    """Return the directories to watch for changes to the files in paths."""
+    directories = []
+    for path in paths:
+        if os.path.isdir(path):
+            directories += walk_python_files(path, (), exclude, gitignore, dirs=True)
+        else:
+            directories.append(os.path.dirname(path) or os.curdir)
+    return directories
+
+
+def watch(args: "argparse.Namespace", max_batches: int | None = None) -> int:
+    """
+    Check the files given on the command line, then check them again as they change.
+
+    Only changed files are checked again, and only the findings that are new or fixed
+    are printed, as "+ " or "- " and the finding. Changes are collected until there
+    have been none for DEBOUNCE_SECONDS, so saving several files checks them once.
+    Results are kept in memory, and in the cache unless it is disabled.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+        max_batches (int | None): Return after checking this many batches of changes
+            instead of running until interrupted.
+
+    Returns:
+        int: Exit code, 1 if there were any findings when stopped and 0 otherwise.
+    """
+    include = args.include or DEFAULT_INCLUDE
+    exclude = DEFAULT_EXCLUDE + tuple(args.exclude)
+    gitignore = not args.no_gitignore
+    include_pattern = compile_globs(include)
+
+    def list_files() -> list[str]:
+        return list(expand_paths(args.filenames, include, exclude, gitignore))
+
+    options = {"engine": args.engine, "verbosity": args.verbose}
+    memory = collections.OrderedDict()
+    cache = None if args.no_cache else ResultCache(args.cache_dir, options, memory)
+    known = {}  # Normalized path -> findings
+
+    def check(paths: Iterable[str]) -> None:
+        progress = sys.stdout if args.format == "text" else sys.stderr
+        for path in paths:
+            key = os.path.normpath(path)
+            if os.path.exists(path):
+                output, findings, _ = check_file(
+                    path, None, cache, args.engine, args.timeout, False, args.verbose
+                )
+                progress.write(output)
+            else:
+                findings = []
+            print_delta(known.get(key, []), findings, args.format)
+            if findings:
+                known[key] = findings
+            else:
+                known.pop(key, None)
+        sys.stdout.flush()
+
+    files = {os.path.normpath(path): path for path in list_files()}
+    check(files.values())
+    try:
+        watcher = InotifyWatcher(watch_directories(args.filenames, exclude, gitignore))
+    except OSError:
+        watcher = PollingWatcher(list_files)
+    sys.stderr.write(f"Watching {len(files)} files for changes.\n")
+    sys.stderr.flush()
+
+    try:
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            changed, restructured = watcher.wait(None)
+            if not changed and not restructured:
+                continue
+            while True:
+                more, more_restructured = watcher.wait(DEBOUNCE_SECONDS)
+                if not more and not more_restructured:
+                    break
+                changed |= more
+                restructured |= more_restructured
+            # Editors write temporary files next to the ones being saved, so only
+            # new names that could be included are worth listing the files again for
+            new = [path for path in changed if path not in files]
+            if restructured or any(
+                include_pattern.match(os.path.basename(path)) for path in new
+            ):
+                old = files
+                files = {os.path.normpath(path): path for path in list_files()}
+                changed |= old.keys() ^ files.keys()
+                watcher.watch(watch_directories(args.filenames, exclude, gitignore))
+            check(
+                files.get(path, path)
+                for path in sorted(changed)
+                if path in files or path in known
+            )
+            batches += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if cache is not None:
+            cache.evict()
+            cache.close()
+    return 1 if known else 0
+
+
+def print_delta(old: list[Finding], new: list[Finding], output_format: str) -> None:
+    """
+    Print the findings for a file that were fixed or are new since it was last checked.
+
+    Findings are compared without their line, so editing above a finding doesn't
+    report it again.
+
+    Args:
+        old (list[Finding]): Findings from the last time the file was checked.
+        new (list[Finding]): Findings from checking it now.
+        output_format (str): "text" or "jsonl".
+    """
+    old_keys = collections.Counter(finding._replace(line=0) for finding in old)
+    new_keys = collections.Counter(finding._replace(line=0) for finding in new)
+    fixed = old_keys - new_keys
+    added = new_keys - old_keys
+    lines = []
+    for change, sign, findings, counts in (
+        ("fixed", "-", old, fixed),
+        ("added", "+", new, added),
+    ):
+        for finding in findings:
+            key = finding._replace(line=0)
+            if counts[key] > 0:
+                counts[key] -= 1
+                if output_format == "jsonl":
+                    lines.append(json.dumps({"change": change, **finding._asdict()}))
+                else:
+                    lines.append(f"{sign} {finding}")
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """Check typehints of docstring and args of functions in files for consistency."""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in SUBCOMMANDS:
+        sys.exit(SUBCOMMANDS[argv[0]](argv[1:]))
+    args = build_parser().parse_args(argv)
+    if args.daemon:
+        from check_docstrings_client import default_socket_path
+        from check_docstrings_daemon import serve
 
-    sys.exit(0)
+        serve(args.socket or default_socket_path())
+        sys.exit(0)
+    if args.watch:
+        if args.format == "sarif":
+            build_parser().error("--watch can't be used with --format sarif")
+        if args.shard is not None:
+            build_parser().error("--watch can't be used with --shard")
+        sys.exit(watch(args))
+    sys.exit(run(args))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Thin client for a running ``check_docstrings.py --daemon``.
+
+Forwards its command line, working directory and the environment variables git reads
+to the daemon over a Unix socket and prints what the daemon sends back, so checking
+only costs starting this small script. If no daemon is running, or its socket isn't
+in a directory only the current user can write to, the check is run in this process
+instead.
+
+Messages in both directions are marshalled dicts, each preceded by its length as four
+big-endian bytes. Only built-in modules are used to keep startup fast.
+"""
+import io
+import marshal
+import os
+import socket
+import stat
+import sys
+
+
+def default_socket_path() -> str:
+    """Return the socket the daemon listens on, unique to the current user."""
+    if "CHECK_DOCSTRINGS_SOCKET" in os.environ:
+        return os.environ["CHECK_DOCSTRINGS_SOCKET"]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        directory = os.environ["XDG_RUNTIME_DIR"]
+        return os.path.join(directory, f"check_docstrings-{os.getuid()}.sock")
+    # Anyone can create files in the temporary directory, so the socket goes in a
+    # directory of its own, which the daemon creates for the user alone
+    directory = os.environ.get("TMPDIR", "/tmp")
+    return os.path.join(directory, f"check_docstrings-{os.getuid()}", "daemon.sock")
+
+
+def is_private_directory(path: str) -> bool:
+    """Check if path is a directory of the current user that others can't write to."""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return False
+    return (
+        stat.S_ISDIR(info.st_mode)
+        and info.st_uid == os.getuid()
+        and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+    )
+
+
+def is_private_socket(path: str) -> bool:
+    """Check if path is a socket that only the current user could have created."""
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return (
+        stat.S_ISSOCK(info.st_mode)
+        and info.st_uid == os.getuid()
+        and is_private_directory(os.path.dirname(os.path.abspath(path)))
+    )
+
+
+def is_forwarded(name: str) -> bool:
+    """Check if an environment variable is sent to the daemon, as git reads it."""
+    return name == "PATH" or name.startswith("GIT_")
+
+
+def send_message(file: io.BufferedIOBase, message: dict) -> None:
+    """Write a length-prefixed marshalled message to a binary file."""
+    data = marshal.dumps(message)
+    file.write(len(data).to_bytes(4, "big") + data)
+
+
+def receive_message(file: io.BufferedIOBase) -> dict | None:
+    """Read a message written by send_message, or return None at end of file."""
+    header = file.read(4)
+    if len(header) < 4:
+        return None
+    data = file.read(int.from_bytes(header, "big"))
+    return marshal.loads(data)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run check_docstrings with argv in the daemon and return its exit code."""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    path = default_socket_path()
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        # Another user could be listening on a socket they made, to read requests
+        if not is_private_socket(path):
+            raise OSError(f"{path} is not a socket of the current user")
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        import check_docstrings
+
+        return check_docstrings.main(argv)
+
+    with sock, sock.makefile("rwb") as file:
+        # The environment matters to git, e.g. GIT_INDEX_FILE in a commit hook, but
+        # the rest of it, which may hold credentials, stays here
+        environ = {name: os.environ[name] for name in os.environ if is_forwarded(name)}
+        request = {"argv": argv, "cwd": os.getcwd(), "env": environ}
+        send_message(file, request)
+        file.flush()
+        while (message := receive_message(file)) is not None:
+            if "out" in message:
+                sys.stdout.write(message["out"])
+            elif "err" in message:
+                sys.stderr.write(message["err"])
+            elif "exit" in message:
+                return message["exit"]
+    print("Error: The daemon closed the connection.", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
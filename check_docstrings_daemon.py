@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""Daemon for ``check_docstrings.py --daemon``, serving check_docstrings_client.py.
+
+Kept apart from check_docstrings.py so that checking files doesn't pay for importing
+the socket modules.
+"""
+import collections
+import contextlib
+import io
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+import check_docstrings
+from check_docstrings_client import (
+    is_forwarded,
+    is_private_directory,
+    receive_message,
+    send_message,
+)
+
+
+class MessageWriter(io.TextIOBase):
+    """Text stream that sends what is written to a daemon client as messages."""
+
+    def __init__(self, wfile: io.BufferedIOBase, kind: str) -> None:
+        super().__init__()
+        self.wfile = wfile
+        self.kind = kind
+        self.buffer = []
+        self.size = 0
+
+    def write(self, text: str) -> int:
+        """Buffer text, sending it once enough has been written."""
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= 65536:
+            self.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        """Send everything written so far."""
+        if self.buffer:
+            send_message(self.wfile, {self.kind: "".join(self.buffer)})
+            self.buffer.clear()
+            self.size = 0
+        self.wfile.flush()
+
+
+@contextlib.contextmanager
+def client_environment(cwd: str, environ: dict[str, str] | None) -> Iterator[None]:
+    """
+    Run in a client's working directory and with the environment variables it sent.
+
+    Args:
+        cwd (str): Client's working directory.
+        environ (dict[str, str] | None): Client's variables that git reads, which
+            replace the daemon's, or None to keep the daemon's.
+
+    Yields:
+        None: Once the client's directory and environment are in place. The daemon's
+            environment is restored afterwards.
+    """
+    saved = dict(os.environ)
+    try:
+        os.chdir(cwd)
+        if environ is not None:
+            for name in [name for name in os.environ if is_forwarded(name)]:
+                del os.environ[name]
+            os.environ.update(
+                (name, value) for name, value in environ.items() if is_forwarded(name)
+            )
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    """
+    Handle one request from check_docstrings_client.py.
+
+    The request is a message with the client's argv, working directory and
+    environment. The replies are messages with "out" and "err" text and then the
+    "exit" code.
+    """
+
+    def handle(self) -> None:
+        """Run the client's command line as the client would, streaming the output."""
+        try:
+            request = receive_message(self.rfile)
+            argv, cwd = list(request["argv"]), request["cwd"]
+            environ = request.get("env")
+        except (EOFError, ValueError, KeyError, TypeError):
+            return
+        stdout = MessageWriter(self.wfile, "out")
+        stderr = MessageWriter(self.wfile, "err")
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    with client_environment(cwd, environ):
+                        code = self.run_command(argv)
+                except SystemExit as exc:
+                    code = 1 if exc.code is None else exc.code
+                except Exception:  # Keep serving other clients
+                    traceback.print_exc()
+                    code = 1
+            stdout.flush()
+            stderr.flush()
+            send_message(self.wfile, {"exit": code})
+        except OSError:
+            pass  # The client went away
+
+    def run_command(self, argv: list[str]) -> int:
+        """Run a command line, reusing the server's worker processes and results."""
+        if argv and argv[0] in check_docstrings.SUBCOMMANDS:
+            return check_docstrings.SUBCOMMANDS[argv[0]](argv[1:])
+        args = check_docstrings.build_parser().parse_args(argv)
+        if args.daemon:
+            print("Error: A daemon is already running.")
+            return 1
+        return check_docstrings.run(args, self.server.executor, self.server.memory)
+
+
+def serve(socket_path: str) -> None:
+    """
+    Serve checks on a Unix socket until interrupted or terminated.
+
+    Compiled patterns, a pool of worker processes and recently used cache entries stay
+    in memory between requests, so clients don't pay for interpreter startup. Requests
+    are handled one at a time, each in the client's working directory.
+
+    The socket has to be in a directory that only the current user can write to,
+    which is created if missing, so no one else can listen in its place.
+
+    Args:
+        socket_path (str): Path of the Unix socket to listen on.
+    """
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    except OSError as exc:
+        print(f"Error: Could not create {directory}: {exc}")
+        sys.exit(1)
+    if not is_private_directory(directory):
+        print(f"Error: {directory} must belong to you and not be writable by others")
+        sys.exit(1)
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX) as probe:
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.unlink(socket_path)  # Left behind by a daemon that died
+            else:
+                print(f"Error: A daemon is already listening on {socket_path}")
+                sys.exit(1)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    old_umask = os.umask(0o077)
+    try:
+        server = socketserver.UnixStreamServer(socket_path, DaemonHandler)
+    finally:
+        os.umask(old_umask)
+    server.executor = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+    server.memory = collections.OrderedDict()
+    print(f"Listening on {socket_path}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown(cancel_futures=True)
+        os.unlink(socket_path)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""Language server that shows check_docstrings findings as diagnostics in editors.
+
+Speaks the Language Server Protocol over stdin and stdout: configure the editor to run
+``python check_docstrings_lsp.py`` for Python files. Open documents are kept in memory
+and checked again on every edit. Functions whose name, args and docstring haven't
+changed keep their findings from the last check, so only the edited functions are
+checked again, and diagnostics are only published when they change.
+
+The engine can be chosen with the initialization option ``{"engine": "ast"}``.
+"""
+import json
+import sys
+import traceback
+import urllib.parse
+from typing import BinaryIO
+
+import check_docstrings
+
+# Text documents are synced incrementally
+SYNC_INCREMENTAL = 2
+SEVERITY_ERROR = 1
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+
+
+def read_message(stream: BinaryIO) -> dict | None:
+    """Read a message with a Content-Length header, or return None at end of file."""
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    if length is None:
+        raise ValueError("message without a Content-Length header")
+    return json.loads(stream.read(length))
+
+
+def write_message(stream: BinaryIO, message: dict) -> None:
+    """Write a message with a Content-Length header and flush it."""
+    body = json.dumps(message, separators=(",", ":")).encode("utf8")
+    stream.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    stream.flush()
+
+
+def position_index(text: str, position: dict) -> int:
+    """
+    Convert an LSP position to an index into text.
+
+    Args:
+        text (str): Text of the document.
+        position (dict): Zero-based line, and character offset in UTF-16 code units.
+
+    Returns:
+        int: Index of the position in text, clamped to the end of its line.
+    """
+    start = 0
+    for _ in range(position["line"]):
+        start = text.find("\n", start) + 1
+        if start == 0:
+            return len(text)
+    end = text.find("\n", start)
+    if end == -1:
+        end = len(text)
+    character = position["character"]
+    if text[start:end].isascii():
+        return min(start + character, end)
+    units = 0
+    for index in range(start, end):
+        if units >= character:
+            return index
+        # Characters outside the Basic Multilingual Plane take two code units
+        units += 2 if ord(text[index]) > 0xFFFF else 1
+    return end
+
+
+def apply_change(text: str, change: dict) -> str:
+    """Return text with a textDocument/didChange content change applied."""
+    if "range" not in change:
+        return change["text"]
+    start = position_index(text, change["range"]["start"])
+    end = position_index(text, change["range"]["end"])
+    return text[:start] + change["text"] + text[end:]
+
+
+def uri_to_path(uri: str) -> str:
+    """Return the file path of a file:// URI, or the URI itself for other schemes."""
+    parsed = urllib.parse.urlparse(uri)
+    if parsed.scheme != "file":
+        return uri
+    return urllib.parse.unquote(parsed.path)
+
+
+class Document:
+    """An open document, with the findings of each function from its last check."""
+
+    def __init__(self, uri: str, text: str) -> None:
+        self.uri = uri
+        self.path = uri_to_path(uri)
+        self.text = text
+        # (name, args, docstring) -> findings, with line 0
+        self.functions = {}
+        self.diagnostics = None
+
+
+class LanguageServer:
+    """
+    Handle the messages from an editor, writing responses and diagnostics to output.
+
+    Only the messages needed to keep documents in sync and publish diagnostics are
+    implemented. Other requests get a MethodNotFound error.
+    """
+
+    def __init__(self, output: BinaryIO) -> None:
+        self.output = output
+        self.documents = {}
+        self.engine = "scan"
+        self.shutdown = False
+        self.exit_code = None
+        self.checked = 0  # Functions checked, as opposed to reused
+
+    def handle(self, message: dict) -> None:
+        """Handle a request or notification, answering requests."""
+        method = message.get("method")
+        handler = self.HANDLERS.get(method)
+        is_request = "id" in message
+        if handler is None:
+            if is_request and method is not None:
+                message_text = f"Unknown method {method}"
+                error = {"code": METHOD_NOT_FOUND, "message": message_text}
+                self.send({"id": message["id"], "error": error})
+            return
+        try:
+            result = handler(self, message.get("params") or {})
+        except Exception as exc:  # Keep serving the editor
+            traceback.print_exc()
+            if is_request:
+                error = {"code": INTERNAL_ERROR, "message": str(exc)}
+                self.send({"id": message["id"], "error": error})
+            return
+        if is_request:
+            self.send({"id": message["id"], "result": result})
+
+    def send(self, message: dict) -> None:
+        """Send a message to the editor."""
+        write_message(self.output, {"jsonrpc": "2.0", **message})
+
+    def initialize(self, params: dict) -> dict:
+        """Choose the engine and describe what the server can do."""
+        options = params.get("initializationOptions") or {}
+        if options.get("engine") in check_docstrings.ENGINES:
+            self.engine = options["engine"]
+        return {
+            "capabilities": {
+                "textDocumentSync": {"openClose": True, "change": SYNC_INCREMENTAL}
+            },
+            "serverInfo": {
+                "name": "check_docstrings",
+                "version": check_docstrings.__version__,
+            },
+        }
+
+    def did_open(self, params: dict) -> None:
+        """Start tracking a document and publish its diagnostics."""
+        item = params["textDocument"]
+        document = Document(item["uri"], item["text"])
+        self.documents[document.uri] = document
+        self.publish(document)
+
+    def did_change(self, params: dict) -> None:
+        """Apply edits to a document and publish its diagnostics if they changed."""
+        document = self.documents[params["textDocument"]["uri"]]
+        for change in params["contentChanges"]:
+            document.text = apply_change(document.text, change)
+        self.publish(document)
+
+    def did_close(self, params: dict) -> None:
+        """Stop tracking a document and clear its diagnostics."""
+        uri = params["textDocument"]["uri"]
+        self.documents.pop(uri, None)
+        self.notify_diagnostics(uri, [])
+
+    def on_shutdown(self, params: dict) -> None:
+        """Get ready to exit."""
+        self.shutdown = True
+
+    def on_exit(self, params: dict) -> None:
+        """Stop serving, successfully only if a shutdown was requested first."""
+        self.exit_code = 0 if self.shutdown else 1
+
+    def check(self, document: Document) -> list[check_docstrings.Finding]:
+        """
+        Check a document, reusing the findings of functions that haven't changed.
+
+        Args:
+            document (Document): Document to check.
+
+        Returns:
+            list: Findings for every problem in the document.
+        """
+        functions = {}
+        findings = []
+        for function in check_docstrings.ENGINES[self.engine](document.text):
+            key = (function.name, function.args, function.docstring)
+            results = document.functions.get(key)
+            if results is None:
+                results = check_docstrings.check_function(*key, document.path, 0)
+                self.checked += 1
+            functions[key] = results
+            findings += [finding._replace(line=function.line) for finding in results]
+        document.functions = functions
+        return findings
+
+    def publish(self, document: Document) -> None:
+        """Check a document and publish its diagnostics if they changed."""
+        try:
+            findings = self.check(document)
+        except SyntaxError:
+            return  # Mid-edit; keep showing the last diagnostics
+        diagnostics = [
+            {
+                "range": {
+                    "start": {"line": finding.line - 1, "character": 0},
+                    "end": {"line": finding.line, "character": 0},
+                },
+                "severity": SEVERITY_ERROR,
+                "code": finding.rule,
+                "source": "check_docstrings",
+                "message": finding.message,
+            }
+            for finding in findings
+        ]
+        if diagnostics != document.diagnostics:
+            document.diagnostics = diagnostics
+            self.notify_diagnostics(document.uri, diagnostics)
+
+    def notify_diagnostics(self, uri: str, diagnostics: list[dict]) -> None:
+        """Send the diagnostics for a document."""
+        params = {"uri": uri, "diagnostics": diagnostics}
+        self.send({"method": "textDocument/publishDiagnostics", "params": params})
+
+    HANDLERS = {
+        "initialize": initialize,
+        "textDocument/didOpen": did_open,
+        "textDocument/didChange": did_change,
+        "textDocument/didClose": did_close,
+        "shutdown": on_shutdown,
+        "exit": on_exit,
+    }
+
+
+def main() -> int:
+    """Serve the editor on stdin and stdout until it exits."""
+    server = LanguageServer(sys.stdout.buffer)
+    while server.exit_code is None:
+        message = read_message(sys.stdin.buffer)
+        if message is None:
+            return 1
+        server.handle(message)
+    return server.exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
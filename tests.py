@@ -1,12 +1,66 @@
 """Tests for check_docstrings.py using unittest."""
+import contextlib
+import functools
+import io
+import itertools
+import json
 import os
+import pstats
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+import check_docstrings
+import check_docstrings_client
+import check_docstrings_lsp
 from check_docstrings import main
 
+WORKING_FILE = (
+    "def one_arg(arg: int) -> None:\n"
+    '    """\n'
+    "    One argument.\n"
+    "\n"
+    "    Args:\n"
+    "        arg (int): Integer.\n"
+    '    """\n'
+    "    return\n"
+)
+
+MISMATCH_FILE = (
+    "def one_mismatch_arg(a: int) -> None:\n"
+    '   """\n'
+    "   One argument.\n"
+    "\n"
+    "   Args:\n"
+    "       a (str): Integer.\n"
+    '   """\n'
+    "   return\n"
+)
+
+
+def use_temporary_cache_home(test: unittest.TestCase) -> None:
+    """Keep the default cache directory out of the home directory during a test."""
+    cache_home = tempfile.TemporaryDirectory()
+    test.addCleanup(cache_home.cleanup)
+    env = mock.patch.dict(os.environ, {"XDG_CACHE_HOME": cache_home.name})
+    env.start()
+    test.addCleanup(env.stop)
+
 
 class TestCheckDocstrings(unittest.TestCase):
     """Test class for check_docstrings."""
 
+    options = []
+
+    def setUp(self):
+        use_temporary_cache_home(self)
+
     def write_str_and_assert_exception(self, file_content, code):
         """Write file_content to a file and check that main() raises code."""
         file = "test_file.py"
@@ -15,7 +69,7 @@ class TestCheckDocstrings(unittest.TestCase):
 
         try:
             with self.assertRaises(SystemExit) as cm:
-                main([file])
+                main([*self.options, file])
             self.assertEqual(cm.exception.code, code)
         finally:
             os.remove(file)  # Clean up: remove the temporary file
@@ -266,5 +320,1375 @@ class TestCheckDocstrings(unittest.TestCase):
         )
 
 
+class TestCheckDocstringsRegexEngine(TestCheckDocstrings):
+    """Run the same checks with the regex engine."""
+
+    options = ["--engine", "regex"]
+
+
+class TestCheckDocstringsAstEngine(TestCheckDocstrings):
+    """Run the same checks with the AST engine."""
+
+    options = ["--engine", "ast"]
+
+
+class TestScanEngine(unittest.TestCase):
+    """Test the linear-time scan engine."""
+
+    def assert_same_as_regex(self, code):
+        functions = list(check_docstrings.find_functions_scan(code))
+        self.assertEqual(functions, list(check_docstrings.find_functions_regex(code)))
+        return functions
+
+    def test_same_as_regex(self):
+        code = (
+            WORKING_FILE
+            + "def no_docstring(a: int) -> None:\n    return\n"
+            + "def unclosed(a: int) -> None:\n    \"\"\" \"\n"
+            + "def arrow(a: int)\n  -> dict:\r\n\n  \"\"\"Doc.\"\"\"\n"
+            + "undef f():\n\"\"\"Doc.\"\"\""
+        )
+        functions = self.assert_same_as_regex(code)
+        self.assertEqual([f.name for f in functions], ["one_arg", "arrow", "f"])
+        self.assertEqual([f.line for f in functions], [1, 13, 17])
+
+    def test_adversarial_input_is_fast(self):
+        # Each of these takes the regex engine quadratic time, i.e. minutes
+        for code in (
+            "def f(" + "def g(" * 50000 + ")",
+            "def f(a: int):" + "\n" * 50000 + "x = 1\n",
+            "def f() -> " + "a) -> " * 50000 + ":\n",
+        ):
+            start = time.monotonic()
+            self.assertEqual(list(check_docstrings.find_functions_scan(code)), [])
+            self.assertLess(time.monotonic() - start, 1)
+
+    def test_bytes(self):
+        code = (
+            WORKING_FILE
+            + 'def café(a: int):\n    """\n    Ünïcode.\n\n    Args:\n'
+            + '        a (int): A.\n    """\n'
+            + MISMATCH_FILE
+        )
+        functions = list(check_docstrings.find_functions_scan(code.encode()))
+        self.assertEqual(functions, self.assert_same_as_regex(code))
+        self.assertEqual(functions[1].name, "café")
+
+    def test_timeout(self):
+        code = WORKING_FILE * 3
+        with mock.patch.object(
+            check_docstrings.time, "monotonic", side_effect=itertools.count()
+        ):
+            findings = check_docstrings.check_code(code, "test.py", timeout=1.5)
+        (finding,) = findings
+        self.assertEqual((finding.rule, finding.line), ("timeout", 9))
+
+
+class TestAstEngine(unittest.TestCase):
+    """Test cases only the AST engine handles."""
+
+    def check(self, code):
+        return check_docstrings.check_code(code, "test.py", engine="ast")
+
+    def test_finds_what_regex_misses(self):
+        code = (
+            "import functools\n"
+            "\n"
+            "\n"
+            "@functools.cache\n"
+            "async def decorated(a: int = max(1, 2), b: dict[str, int] = None):\n"
+            "    \'\'\'\n"
+            "    Decorated async function.\n"
+            "\n"
+            "    Args:\n"
+            "        a (int): Integer.\n"
+            "        b (str): Dictionary.\n"
+            "    \'\'\'\n"
+        )
+        self.assertEqual(check_docstrings.check_code(code, "test.py"), [])
+        (finding,) = self.check(code)
+        self.assertEqual(finding.rule, "type-hint-mismatch")
+        self.assertEqual((finding.function, finding.line), ("decorated", 5))
+
+    def test_methods_and_nested_functions(self):
+        code = (
+            "class A:\n"
+            '    """Class."""\n'
+            "\n"
+            "    def method(self, a: int) -> None:\n"
+            '        """Method."""\n'
+            "\n"
+            "        def nested(b):\n"
+            '            """Nested."""\n'
+        )
+        findings = self.check(code)
+        self.assertEqual(
+            [(f.function, f.rule) for f in findings], [("nested", "missing-type-hint")]
+        )
+        functions = check_docstrings.find_functions_ast(code)
+        self.assertEqual([f.args for f in functions], ["a: int", "b"])
+
+    def test_syntax_error(self):
+        (finding,) = self.check("def broken(:\n    pass\n")
+        self.assertEqual((finding.rule, finding.line), ("syntax-error", 1))
+
+
+class TestNormalizeTypeHint(unittest.TestCase):
+    """Test that equivalent spellings of a type hint compare equal."""
+
+    def test_equivalent_hints(self):
+        equivalent = [
+            ["int | None", "Optional[int]", "typing.Optional[int]", "Union[None, int]"],
+            ["list[int]", "List[int]", "typing.List[ int ]"],
+            ["dict[str, int]", "dict[str,int]", "Dict[str, int]"],
+            ["int | str | None", "Optional[Union[str, int]]", "str|None|int"],
+            ["list[int | str] | None", "Optional[List[Union[str, int]]]"],
+        ]
+        for hints in equivalent:
+            with self.subTest(hints=hints):
+                normalized = {check_docstrings.normalize_type_hint(h) for h in hints}
+                self.assertEqual(normalized, {hints[0]})
+
+    def test_different_hints(self):
+        for first, second in [
+            ("int", "str"),
+            ("list[int]", "list[str]"),
+            ("int | None", "int"),
+            ('Literal["a"]', "Literal[a]"),
+            ("dict[str, int]", "dict[int, str]"),
+        ]:
+            with self.subTest(first=first, second=second):
+                self.assertNotEqual(
+                    check_docstrings.normalize_type_hint(first),
+                    check_docstrings.normalize_type_hint(second),
+                )
+
+    def test_invalid_hint(self):
+        normalize = check_docstrings.normalize_type_hint
+        self.assertEqual(normalize("int, optional"), "(int, optional)")
+        self.assertEqual(normalize("list of int"), "listofint")
+
+    def test_equivalent_hints_pass(self):
+        code = (
+            "def f(a: Sequence[str] | None = None, b: Dict[str, int] = {}) -> None:\n"
+            '    """\n'
+            "    Function.\n"
+            "\n"
+            "    Args:\n"
+            "        a (Optional[Sequence[str]]): Strings.\n"
+            "        b (dict[str, int]): Dictionary.\n"
+            '    """\n'
+        )
+        for engine in check_docstrings.ENGINES:
+            with self.subTest(engine=engine):
+                findings = check_docstrings.check_code(code, "test.py", engine)
+                self.assertEqual(findings, [])
+
+
+class TestLruMemo(unittest.TestCase):
+    """Test the byte-budgeted memos for parsed docstrings and signatures."""
+
+    def test_hits_and_evictions(self):
+        calls = []
+        memo = check_docstrings.LruMemo(calls.append, max_bytes=1000)
+        first, second, large = "a" * 300, "b" * 300, "c" * 2000
+        for arg in (first, second, first, large, large):
+            memo(arg)
+        # The large argument doesn't fit in the budget, so it isn't remembered
+        self.assertEqual(calls, [first, second, large, large])
+        self.assertEqual((memo.hits, memo.misses, memo.evictions), (1, 4, 0))
+        memo("d" * 300)  # Evicts second, the least recently used
+        memo(first)
+        memo(second)
+        self.assertEqual(calls[-2:], ["d" * 300, second])
+        self.assertLessEqual(memo.size, memo.max_bytes)
+        self.assertEqual(memo.evictions, 2)
+
+    def test_memoized_parsers(self):
+        parse = check_docstrings.parse_google_docstring
+        docstring = "Doc.\n\nArgs:\n    a (int): A.\n"
+        self.assertIs(parse(docstring), parse(docstring))
+        self.assertEqual(parse.__name__, "parse_google_docstring")
+        get_type_hints = check_docstrings.get_type_hints_from_args
+        self.assertEqual(get_type_hints(["a:int=1", "b:str"]), {"a": "int", "b": "str"})
+        self.assertIs(get_type_hints(["b:str"]), get_type_hints(["b:str"]))
+
+
+class FilesTestCase(unittest.TestCase):
+    """Base class for tests that write files to a temporary directory and run main()."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        use_temporary_cache_home(self)
+
+    def write_files(self, contents):
+        """Write each string in contents to its own file and return the paths."""
+        paths = []
+        for i, content in enumerate(contents):
+            path = os.path.join(self.tmpdir.name, f"file_{i}.py")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+            paths.append(path)
+        return paths
+
+    def run_main(self, argv):
+        """Run main() with argv and return its exit code and printed output."""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertRaises(SystemExit) as cm:
+            main(argv)
+        return cm.exception.code, output.getvalue()
+
+
+class TestParallelChecking(FilesTestCase):
+    """Test checking several files with a pool of worker processes."""
+
+    def test_parallel_output_in_input_order(self):
+        paths = self.write_files([WORKING_FILE] * 8)
+        code, output = self.run_main(["--verbose", "--jobs", "4", *paths])
+        self.assertEqual(code, 0)
+        serial_code, serial_output = self.run_main(["-v", "--jobs", "1", *paths])
+        self.assertEqual(serial_code, 0)
+        self.assertEqual(output, serial_output)
+        checked = [line.rsplit(" ", 1)[-1] for line in output.splitlines()]
+        self.assertEqual(checked, [f"{path}..." for path in paths])
+
+    def test_parallel_failure(self):
+        paths = self.write_files([WORKING_FILE, MISMATCH_FILE, WORKING_FILE])
+        code, output = self.run_main(["--verbose", "--jobs", "3", *paths])
+        self.assertEqual(code, 1)
+        self.assertIn("Type hint mismatch", output)
+        self.assertIn(paths[2], output)
+
+    def test_invalid_jobs(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            code, _ = self.run_main(["--jobs", "0", "file.py"])
+        self.assertEqual(code, 2)
+
+
+class TestCollectAllFindings(FilesTestCase):
+    """Test that every problem is reported in a single run."""
+
+    def test_findings_in_one_file(self):
+        findings = check_docstrings.check_code(
+            WORKING_FILE + "\n" + MISMATCH_FILE + "\n" + MISMATCH_FILE, "test.py"
+        )
+        self.assertEqual([f.rule for f in findings], ["type-hint-mismatch"] * 2)
+        self.assertEqual([f.line for f in findings], [10, 19])
+        self.assertEqual(findings[0].function, "one_mismatch_arg")
+        self.assertEqual(
+            str(findings[0]),
+            "test.py:10: Type hint mismatch for argument 'a' in function "
+            "'one_mismatch_arg'.",
+        )
+
+    def test_findings_across_files(self):
+        paths = self.write_files([MISMATCH_FILE, WORKING_FILE, MISMATCH_FILE])
+        missing = os.path.join(self.tmpdir.name, "missing.py")
+        code, output = self.run_main(["--jobs", "1", "--no-cache", *paths, missing])
+        self.assertEqual(code, 1)
+        self.assertIn(f"{paths[0]}:1: Type hint mismatch", output)
+        self.assertIn(f"{paths[2]}:1: Type hint mismatch", output)
+        self.assertIn(f"{missing}: No such file or directory.", output)
+        self.assertIn("Found 3 problem(s).", output)
+
+    def test_unreadable_files_are_findings(self):
+        paths = self.write_files([MISMATCH_FILE, WORKING_FILE])
+        latin1 = os.path.join(self.tmpdir.name, "latin1.py")
+        with open(latin1, "w", encoding="latin-1") as f:
+            f.write(WORKING_FILE.replace("Integer", "Entier \xe9"))
+        for engine, jobs in itertools.product(check_docstrings.ENGINES, ["1", "2"]):
+            with self.subTest(engine=engine, jobs=jobs):
+                argv = ["--no-cache", "--jobs", jobs, "--engine", engine]
+                code, output = self.run_main([*argv, *paths, latin1])
+                self.assertEqual(code, 1)
+                self.assertIn(f"{paths[0]}:1: Type hint mismatch", output)
+                self.assertIn(f"{latin1}: Could not decode file as UTF-8", output)
+                self.assertIn("Found 2 problem(s).", output)
+
+        error = PermissionError(13, "Permission denied")
+        finding = check_docstrings.file_error_finding("a.py", error)
+        self.assertEqual(finding.rule, "unreadable")
+        self.assertEqual(str(finding), "a.py: Could not read file: Permission denied.")
+
+    def test_missing_type_hint_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            check_docstrings.check_args_for_type_hints("a, b: int")
+
+
+class TestOutputFormats(FilesTestCase):
+    """Test the --format and --verbose options."""
+
+    def test_quiet_by_default(self):
+        paths = self.write_files([WORKING_FILE, MISMATCH_FILE])
+        code, output = self.run_main(["--no-cache", *paths])
+        self.assertEqual(code, 1)
+        self.assertEqual(
+            output,
+            f"{paths[1]}:1: Type hint mismatch for argument 'a' in function "
+            "'one_mismatch_arg'.\nFound 1 problem(s).\n",
+        )
+        self.assertEqual(self.run_main(["--no-cache", paths[0]]), (0, ""))
+
+    def test_jsonl(self):
+        paths = self.write_files([MISMATCH_FILE, WORKING_FILE])
+        missing = os.path.join(self.tmpdir.name, "missing.py")
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            argv = ["--verbose", "--format", "jsonl", *paths, missing]
+            code, output = self.run_main(argv)
+        self.assertEqual(code, 1)
+        findings = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual(
+            [(f["filename"], f["line"], f["rule"]) for f in findings],
+            [(paths[0], 1, "type-hint-mismatch"), (missing, 0, "file-not-found")],
+        )
+        self.assertEqual(findings[0]["function"], "one_mismatch_arg")
+        self.assertEqual(errors.getvalue().count("Checking docstring"), 2)
+
+    def test_sarif(self):
+        paths = self.write_files([MISMATCH_FILE, MISMATCH_FILE])
+        code, output = self.run_main(["--format", "sarif", *paths])
+        self.assertEqual(code, 1)
+        (sarif_run,) = json.loads(output)["runs"]
+        rules = {rule["id"] for rule in sarif_run["tool"]["driver"]["rules"]}
+        self.assertEqual(rules, set(check_docstrings.RULES))
+        results = sarif_run["results"]
+        self.assertEqual([r["ruleId"] for r in results], ["type-hint-mismatch"] * 2)
+        location = results[1]["locations"][0]["physicalLocation"]
+        self.assertEqual(location["region"], {"startLine": 1})
+        self.assertTrue(location["artifactLocation"]["uri"].endswith("file_1.py"))
+
+        (path,) = self.write_files([WORKING_FILE])
+        code, output = self.run_main(["--format", "sarif", path])
+        self.assertEqual(code, 0)
+        self.assertEqual(json.loads(output)["runs"][0]["results"], [])
+
+    def test_verbosity_levels(self):
+        (path,) = self.write_files(
+            ['def f():\n    """Single line."""\n\n\ndef g(a: int):\n    """A."""\n']
+        )
+        levels = ([], ["-v"], ["-vv"])
+        outputs = [self.run_main([*flags, "--no-cache", path]) for flags in levels]
+        self.assertEqual(outputs[0], (0, ""))
+        self.assertEqual(outputs[1][1].count("Checking docstring"), 2)
+        self.assertNotIn("nothing to check", outputs[1][1])
+        self.assertEqual(
+            outputs[2][1].splitlines(),
+            [
+                f"Checking docstring for function 'f' in {path}...",
+                "No args to check",
+                f"Checking docstring for function 'g' in {path}...",
+                "Single line docstring, nothing to check.",
+            ],
+        )
+
+    def test_output_written_in_chunks(self):
+        stream = mock.Mock(spec=io.StringIO)
+        stream.isatty.return_value = False
+        reporter = check_docstrings.Reporter("text", stream, stream)
+        reporter.begin()
+        finding = check_docstrings.Finding("f.py", 1, "f", "timeout", "Slow.")
+        for _ in range(100):
+            reporter.file("Checking...\n", [finding])
+        stream.write.assert_not_called()
+        reporter.end()
+        stream.write.assert_called_once_with(
+            "Checking...\nf.py:1: Slow.\n" * 100 + "Found 100 problem(s).\n"
+        )
+
+
+class TestLibraryApi(FilesTestCase):
+    """Test check_source and check_paths, which return findings instead of printing."""
+
+    def test_check_source(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            findings = check_docstrings.check_source(WORKING_FILE + MISMATCH_FILE)
+            self.assertEqual(check_docstrings.check_source(WORKING_FILE, "a.txt"), [])
+        self.assertEqual(output.getvalue(), "")
+        (finding,) = findings
+        self.assertEqual(finding.filename, "<string>")
+        self.assertEqual((finding.line, finding.rule), (9, "type-hint-mismatch"))
+        self.assertFalse(hasattr(finding, "__dict__"))
+
+    def test_check_paths(self):
+        paths = self.write_files([MISMATCH_FILE, WORKING_FILE])
+        missing = os.path.join(self.tmpdir.name, "missing.py")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            findings = check_docstrings.check_paths([self.tmpdir.name, missing])
+            self.assertEqual(next(findings).filename, paths[0])
+            self.assertEqual([f.rule for f in findings], ["file-not-found"])
+        self.assertEqual(output.getvalue(), "")
+
+    def test_check_paths_reports_decode_errors(self):
+        (path,) = self.write_files([MISMATCH_FILE])
+        latin1 = os.path.join(self.tmpdir.name, "latin1.py")
+        with open(latin1, "wb") as f:
+            f.write(WORKING_FILE.encode("utf-8").replace(b"Integer", b"Entier \xe9"))
+        findings = list(check_docstrings.check_paths([latin1, path]))
+        self.assertEqual(
+            [(f.filename, f.rule) for f in findings],
+            [(latin1, "decode-error"), (path, "type-hint-mismatch")],
+        )
+
+    def test_check_paths_cache(self):
+        paths = self.write_files([MISMATCH_FILE])
+        cache_dir = os.path.join(self.tmpdir.name, "cache")
+        cold = list(check_docstrings.check_paths(paths, cache_dir=cache_dir))
+        with mock.patch.object(check_docstrings, "check_code") as check_code:
+            warm = list(check_docstrings.check_paths(paths, cache_dir=cache_dir))
+        check_code.assert_not_called()
+        self.assertEqual(warm, cold)
+
+    def test_import_leaves_out_rarely_needed_modules(self):
+        lazy = [
+            "argparse",
+            "concurrent.futures",
+            "ctypes",
+            "socket",
+            "sqlite3",
+            "tempfile",
+        ]
+        code = (
+            "import sys, check_docstrings\n"
+            "check_docstrings.check_source('')\n"
+            f"print([name for name in {lazy!r} if name in sys.modules])\n"
+        )
+        directory = os.path.dirname(os.path.abspath(check_docstrings.__file__))
+        result = subprocess.run(
+            [sys.executable, "-c", code], cwd=directory, capture_output=True, text=True
+        )
+        self.assertEqual(result.stdout, "[]\n", result.stderr)
+
+
+class GitTestCase(FilesTestCase):
+    """Base class for tests that run main() in a new git repository."""
+
+    def setUp(self):
+        super().setUp()
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        self.addCleanup(os.chdir, cwd)
+        self.git("init", "-q")
+        self.git("config", "user.email", "test@example.com")
+        self.git("config", "user.name", "Test")
+
+    def git(self, *args):
+        subprocess.run(["git", *args], check=True, capture_output=True)
+
+
+class TestDiffOnly(GitTestCase):
+    """Test only checking functions touched by a git diff."""
+
+    def test_parse_diff(self):
+        diff = (
+            "diff --git a.py a.py\n"
+            "--- a.py\n"
+            "+++ a.py\n"
+            "@@ -1 +1 @@\n"
+            "-x = 1\n"
+            "+x = 2\n"
+            "@@ -5,2 +5,0 @@\n"
+            "@@ -9,0 +8,3 @@\n"
+            "--- b.py\n"
+            "+++ /dev/null\n"
+            "@@ -1,2 +0,0 @@\n"
+        )
+        self.assertEqual(
+            check_docstrings.parse_diff(diff), {"a.py": [(1, 1), (5, 6), (8, 10)]}
+        )
+
+    def test_only_changed_functions_are_checked(self):
+        (path,) = self.write_files([MISMATCH_FILE + WORKING_FILE])
+        path = os.path.basename(path)
+        self.git("add", path)
+        self.git("commit", "-q", "-m", "Add file")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(MISMATCH_FILE.replace("one_mismatch_arg", "new_mismatch"))
+        code, output = self.run_main(["--jobs", "1", "--diff-only", path])
+        self.assertEqual((code, output), (0, ""))
+
+        self.git("add", path)
+        code, output = self.run_main(["--jobs", "1", "--diff-only", path])
+        self.assertEqual(code, 1)
+        self.assertIn("'new_mismatch'", output)
+        self.assertNotIn("'one_mismatch_arg'", output)
+        since = self.run_main(["--jobs", "1", "--since", "HEAD", path])
+        self.assertEqual(since, (code, output))
+
+    def test_paths_outside_the_current_directory(self):
+        (path,) = self.write_files([WORKING_FILE])
+        self.git("add", path)
+        self.git("commit", "-q", "-m", "Add file")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(MISMATCH_FILE)
+        self.git("add", path)
+        os.mkdir("sub")
+        os.chdir("sub")
+        relative = os.path.join(os.pardir, os.path.basename(path))
+        for given in (os.path.abspath(relative), relative):
+            with self.subTest(path=given):
+                code, output = self.run_main(["--jobs", "1", "--diff-only", given])
+                self.assertEqual(code, 1)
+                self.assertIn(f"{given}:9: Type hint mismatch", output)
+
+    def test_symlinks_and_relative_diff_config(self):
+        (path,) = self.write_files([WORKING_FILE])
+        self.git("add", path)
+        self.git("commit", "-q", "-m", "Add file")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(MISMATCH_FILE)
+        self.git("add", path)
+        # Makes git print paths relative to the current directory unless told not to
+        self.git("config", "diff.relative", "true")
+        links = tempfile.TemporaryDirectory()
+        self.addCleanup(links.cleanup)
+        link = os.path.join(links.name, "repo")
+        os.symlink(self.tmpdir.name, link)
+        os.mkdir("sub")
+        os.chdir("sub")
+        for given in (os.path.join(link, os.path.basename(path)), path):
+            with self.subTest(path=given):
+                code, output = self.run_main(["--jobs", "1", "--diff-only", given])
+                self.assertEqual(code, 1)
+                self.assertIn(f"{given}:9: Type hint mismatch", output)
+
+    def test_not_a_repository(self):
+        shutil.rmtree(".git")
+        code, output = self.run_main(["--diff-only", "file.py"])
+        self.assertEqual(code, 1)
+        self.assertIn("Could not get the diff from git", output)
+
+
+@mock.patch.object(check_docstrings, "RACY_NANOSECONDS", 0)
+class TestGitObjects(GitTestCase):
+    """Test looking files up in the cache by their git blob ID."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(self.tmpdir.name, "cache")
+        paths = self.write_files([MISMATCH_FILE, WORKING_FILE])
+        self.paths = [os.path.basename(path) for path in paths]
+        self.git("add", *self.paths)
+        self.git("commit", "-q", "-m", "Add files")
+
+    def run_git_objects(self, paths):
+        argv = ["--jobs", "1", "--git-objects", "--cache-dir", self.cache_dir]
+        return self.run_main([*argv, *paths])
+
+    def test_clone_skips_reading(self):
+        cold = self.run_git_objects(self.paths)
+        self.assertEqual(cold[0], 1)
+        # Files in a clone have new stats, but the same blob IDs
+        self.git("clone", "-q", ".", "clone")
+        os.chdir("clone")
+        read_source = mock.patch.object(
+            check_docstrings, "read_source", wraps=check_docstrings.read_source
+        )
+        with read_source as read:
+            self.assertEqual(self.run_git_objects(self.paths), cold)
+        read.assert_not_called()
+
+    def test_modified_files_are_read(self):
+        self.run_git_objects(self.paths)
+        self.git("clone", "-q", ".", "clone")
+        os.chdir("clone")
+        with open(self.paths[0], "w", encoding="utf-8") as f:
+            f.write(WORKING_FILE)
+        self.assertEqual(self.run_git_objects(self.paths), (0, ""))
+
+    def test_blob_ids(self):
+        staged, modified = (os.path.abspath(path) for path in self.paths)
+        with open(staged, "a", encoding="utf-8") as f:
+            f.write("\n")
+        self.git("add", staged)
+        with open(modified, "a", encoding="utf-8") as f:
+            f.write("\n")
+        os.mkdir("sub")
+        os.chdir("sub")
+        blobs = check_docstrings.git_blob_ids([os.pardir])
+        # Staged changes are in the index, so only the modified file is left out
+        self.assertEqual(list(blobs), [staged])
+        self.assertRegex(blobs[staged], "^[0-9a-f]{40}$")
+
+    def test_not_a_repository(self):
+        shutil.rmtree(".git")
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            code, output = self.run_git_objects(self.paths)
+        self.assertEqual(code, 1)
+        self.assertIn("Type hint mismatch", output)
+        self.assertIn("Not using git blob IDs", stderr.getvalue())
+
+
+class TestWatch(FilesTestCase):
+    """Test checking files again as they change with --watch."""
+
+    def run_watch(self, inotify, changes):
+        """Run watch() until changes, made once it is watching, have been checked."""
+        ready = threading.Event()
+        watcher_class = "InotifyWatcher" if inotify else "PollingWatcher"
+        original = getattr(check_docstrings, watcher_class)
+
+        def make_watcher(*args):
+            watcher = original(*args)
+            ready.set()
+            return watcher
+
+        def make_changes():
+            ready.wait(5)
+            for change in changes:
+                change()
+                # Longer than a poll and the debounce, so each change is a batch
+                time.sleep(0.6 if not inotify else 0.2)
+
+        patches = [mock.patch.object(check_docstrings, watcher_class, make_watcher)]
+        if not inotify:
+            unavailable = mock.Mock(side_effect=OSError)
+            patches.append(
+                mock.patch.object(check_docstrings, "InotifyWatcher", unavailable)
+            )
+        args = check_docstrings.build_parser().parse_args(
+            ["--no-cache", "--watch", self.tmpdir.name]
+        )
+        output = io.StringIO()
+        thread = threading.Thread(target=make_changes)
+        with contextlib.ExitStack() as stack:
+            for patch in patches:
+                stack.enter_context(patch)
+            stack.enter_context(contextlib.redirect_stdout(output))
+            stack.enter_context(contextlib.redirect_stderr(io.StringIO()))
+            thread.start()
+            code = check_docstrings.watch(args, max_batches=len(changes))
+        thread.join()
+        return code, output.getvalue().splitlines()
+
+    def write(self, relative, content):
+        path = os.path.join(self.tmpdir.name, *relative.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def test_watch(self):
+        for inotify in (True, False):
+            with self.subTest(inotify=inotify):
+                good = self.write("good.py", WORKING_FILE)
+                bad = self.write("bad.py", MISMATCH_FILE)
+                new = os.path.join(self.tmpdir.name, f"sub{inotify}", "new.py")
+                message = "Type hint mismatch for argument 'a' in function"
+                code, lines = self.run_watch(
+                    inotify,
+                    [
+                        lambda: self.write("good.py", MISMATCH_FILE),
+                        lambda: self.write(f"sub{inotify}/new.py", MISMATCH_FILE),
+                        lambda: os.remove(bad),
+                        # Only moves the finding, so nothing is printed
+                        lambda: self.write("good.py", "\n" + MISMATCH_FILE),
+                    ],
+                )
+                self.assertEqual(code, 1)
+                self.assertEqual(
+                    lines,
+                    [
+                        f"+ {bad}:1: {message} 'one_mismatch_arg'.",
+                        f"+ {good}:1: {message} 'one_mismatch_arg'.",
+                        f"+ {new}:1: {message} 'one_mismatch_arg'.",
+                        f"- {bad}:1: {message} 'one_mismatch_arg'.",
+                    ],
+                )
+                shutil.rmtree(os.path.dirname(new))
+                os.remove(good)
+
+    def test_print_delta(self):
+        finding = check_docstrings.Finding("a.py", 1, "f", "timeout", "Slow.")
+        moved = finding._replace(line=5)
+        fixed = finding._replace(function="g", message="Gone.")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            check_docstrings.print_delta([finding, fixed], [moved, moved], "text")
+            check_docstrings.print_delta([], [finding], "jsonl")
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[:2], ["- a.py:1: Gone.", "+ a.py:5: Slow."])
+        self.assertEqual(json.loads(lines[2]), {"change": "added", **finding._asdict()})
+
+
+class TestSharding(FilesTestCase):
+    """Test splitting a run into shards with --shard and merging their output."""
+
+    def test_shards_partition_files(self):
+        names = [f"pkg/module_{i}.py" for i in range(100)]
+        shards = [
+            list(check_docstrings.shard_files(names, (index, 3))) for index in range(3)
+        ]
+        self.assertEqual(sorted(sum(shards, [])), sorted(names))
+        self.assertTrue(all(shards))
+        # The same partition whatever form the paths are given in
+        self.assertEqual(
+            list(check_docstrings.shard_files([f"./{n}" for n in names], (0, 3))),
+            [f"./{name}" for name in shards[0]],
+        )
+
+    def test_timings_balance_shards(self):
+        names = [f"module_{i}.py" for i in range(20)]
+        timings = {name: {"seconds": 0.01, "bytes": 100} for name in names}
+        timings["module_0.py"]["seconds"] = 1.0
+        shards = [
+            list(check_docstrings.shard_files(names, (index, 2), timings))
+            for index in range(2)
+        ]
+        self.assertEqual(sorted(sum(shards, [])), sorted(names))
+        self.assertIn(["module_0.py"], shards)
+
+    def test_run_shards_and_merge(self):
+        paths = self.write_files([MISMATCH_FILE] * 6 + [WORKING_FILE] * 2)
+        outputs, timings = [], []
+        for k in range(1, 4):
+            timings.append(os.path.join(self.tmpdir.name, f"timings_{k}.json"))
+            argv = ["--no-cache", "--format", "jsonl", "--shard", f"{k}/3"]
+            code, output = self.run_main([*argv, "--save-timings", timings[-1], *paths])
+            outputs.append(os.path.join(self.tmpdir.name, f"shard_{k}.jsonl"))
+            with open(outputs[-1], "w", encoding="utf-8") as f:
+                f.write(output)
+        # Between them the shards timed every file
+        timed = check_docstrings.read_timings(timings)
+        self.assertEqual(sorted(timed), sorted(map(check_docstrings.shard_key, paths)))
+
+        code, output = self.run_main(["merge", *reversed(outputs)])
+        self.assertEqual(code, 1)
+        _, unsharded = self.run_main(["--no-cache", *paths])
+        self.assertEqual(output, unsharded)
+
+        empty = os.path.join(self.tmpdir.name, "empty.jsonl")
+        open(empty, "w").close()
+        self.assertEqual(self.run_main(["merge", empty]), (0, ""))
+
+    def test_invalid_shard(self):
+        for shard in ["0/3", "4/3", "1", "a/b"]:
+            with self.subTest(shard=shard), contextlib.redirect_stderr(io.StringIO()):
+                with self.assertRaises(SystemExit):
+                    main(["--shard", shard, "file.py"])
+
+
+class TestDaemon(FilesTestCase):
+    """Test checking files through the daemon and its client."""
+
+    def setUp(self):
+        super().setUp()
+        self.socket = os.path.join(self.tmpdir.name, "daemon.sock")
+        env = mock.patch.dict(os.environ, {"CHECK_DOCSTRINGS_SOCKET": self.socket})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def start_daemon(self):
+        script = os.path.abspath(check_docstrings.__file__)
+        daemon = subprocess.Popen(
+            [sys.executable, script, "--daemon", "--socket", self.socket],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        self.addCleanup(daemon.wait)
+        self.addCleanup(daemon.stdout.close)
+        self.addCleanup(daemon.terminate)
+        self.assertEqual(daemon.stdout.readline(), f"Listening on {self.socket}\n")
+        return daemon
+
+    def run_client(self, argv):
+        output = io.StringIO()
+        errors = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(errors):
+            code = check_docstrings_client.main(argv)
+        return code, output.getvalue()
+
+    def test_client_output_matches_main(self):
+        daemon = self.start_daemon()
+        paths = self.write_files([WORKING_FILE, MISMATCH_FILE])
+        argv = ["--cache-dir", os.path.join(self.tmpdir.name, "cache"), *paths]
+        expected = self.run_main(argv)
+        self.assertEqual(self.run_client(argv), expected)
+        self.assertEqual(self.run_client(argv), expected)  # Warm
+
+        code, output = self.run_client(["--jobs", "0"])
+        self.assertEqual((code, output), (2, ""))
+
+        daemon.terminate()
+        daemon.wait()
+        self.assertFalse(os.path.exists(self.socket))
+
+    def test_workers_use_each_clients_directory(self):
+        self.start_daemon()
+        directories = []
+        for content in (WORKING_FILE, MISMATCH_FILE):
+            directory = tempfile.mkdtemp(dir=self.tmpdir.name)
+            with open(os.path.join(directory, "m.py"), "w", encoding="utf-8") as f:
+                f.write(content)
+            directories.append(directory)
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        # The first request starts the workers, in the first client's directory
+        for directory, expected in zip(directories, (0, 1)):
+            os.chdir(directory)
+            code, output = self.run_client(["--jobs", "2", "--no-cache", "."])
+            self.assertEqual(code, expected, output)
+
+    def test_client_environment_is_used(self):
+        self.start_daemon()
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(self.tmpdir.name)
+        (path,) = self.write_files([WORKING_FILE])
+        git = functools.partial(subprocess.run, check=True, capture_output=True)
+        git(["git", "init", "-q"])
+        git(["git", "add", path])
+        # Stage a mismatch in another index, like git commit -a does for its hooks
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(MISMATCH_FILE)
+        index = os.path.join(self.tmpdir.name, "other-index")
+        env = {**os.environ, "GIT_INDEX_FILE": index}
+        git(["git", "read-tree", "--empty"], env=env)
+        git(["git", "add", path], env=env)
+        with mock.patch.dict(os.environ, {"GIT_INDEX_FILE": index}):
+            code, output = self.run_client(["--jobs", "1", "--diff-only", path])
+        self.assertEqual(code, 1, output)
+        # The daemon goes back to its own environment, and the index only has the
+        # working functions
+        code, output = self.run_client(["--jobs", "1", "--diff-only", path])
+        self.assertEqual((code, output), (0, ""))
+
+    def test_client_only_sends_variables_git_reads(self):
+        server = socket.socket(socket.AF_UNIX)
+        self.addCleanup(server.close)
+        server.bind(self.socket)
+        server.listen()
+        requests = []
+
+        def answer():
+            connection, _ = server.accept()
+            with connection, connection.makefile("rwb") as file:
+                requests.append(check_docstrings_client.receive_message(file))
+                check_docstrings_client.send_message(file, {"exit": 0})
+
+        thread = threading.Thread(target=answer)
+        thread.start()
+        with mock.patch.dict(os.environ, {"GIT_DIR": "repo", "API_TOKEN": "secret"}):
+            self.assertEqual(self.run_client([]), (0, ""))
+        thread.join()
+        self.assertEqual(requests[0]["env"]["GIT_DIR"], "repo")
+        self.assertIn("PATH", requests[0]["env"])
+        self.assertNotIn("API_TOKEN", requests[0]["env"])
+
+    def test_socket_in_shared_directory_is_not_used(self):
+        shared = os.path.join(self.tmpdir.name, "shared")
+        os.mkdir(shared)
+        os.chmod(shared, 0o777)
+        path = os.path.join(shared, "daemon.sock")
+        server = socket.socket(socket.AF_UNIX)
+        self.addCleanup(server.close)
+        server.bind(path)
+        server.listen()
+        with mock.patch.dict(os.environ, {"CHECK_DOCSTRINGS_SOCKET": path}):
+            with mock.patch.object(check_docstrings, "main", return_value=0) as main:
+                self.assertEqual(self.run_client(["file.py"]), (0, ""))
+        main.assert_called_once_with(["file.py"])
+
+        script = os.path.abspath(check_docstrings.__file__)
+        daemon = subprocess.run(
+            [sys.executable, script, "--daemon", "--socket", path],
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(daemon.returncode, 1)
+        self.assertIn("not be writable by others", daemon.stdout)
+
+    def test_default_socket_is_in_a_private_directory(self):
+        environ = {"TMPDIR": self.tmpdir.name, "XDG_RUNTIME_DIR": ""}
+        with mock.patch.dict(os.environ, environ):
+            del os.environ["CHECK_DOCSTRINGS_SOCKET"]
+            path = check_docstrings_client.default_socket_path()
+            self.assertEqual(os.path.dirname(os.path.dirname(path)), self.tmpdir.name)
+            self.socket = path
+            self.start_daemon()
+            self.assertTrue(check_docstrings_client.is_private_socket(path))
+
+    def test_client_without_daemon(self):
+        paths = self.write_files([MISMATCH_FILE])
+        with self.assertRaises(SystemExit) as cm:
+            self.run_client(["--no-cache", *paths])
+        self.assertEqual(cm.exception.code, 1)
+
+
+class TestLanguageServer(unittest.TestCase):
+    """Test the language server, fed messages in process."""
+
+    uri = "file:///project/module.py"
+
+    def setUp(self):
+        self.output = io.BytesIO()
+        self.server = check_docstrings_lsp.LanguageServer(self.output)
+
+    def messages(self):
+        """Return the messages sent since the last call."""
+        stream = io.BytesIO(self.output.getvalue())
+        self.output.seek(0)
+        self.output.truncate()
+        messages = []
+        while (message := check_docstrings_lsp.read_message(stream)) is not None:
+            messages.append(message)
+        return messages
+
+    def diagnostics(self):
+        """Return the diagnostics of each publishDiagnostics notification sent."""
+        return [message["params"]["diagnostics"] for message in self.messages()]
+
+    def open(self, text):
+        item = {"uri": self.uri, "languageId": "python", "version": 1, "text": text}
+        self.server.handle(
+            {"method": "textDocument/didOpen", "params": {"textDocument": item}}
+        )
+
+    def change(self, line, start, end, text):
+        change = {
+            "range": {
+                "start": {"line": line, "character": start},
+                "end": {"line": line, "character": end},
+            },
+            "text": text,
+        }
+        params = {"textDocument": {"uri": self.uri}, "contentChanges": [change]}
+        self.server.handle({"method": "textDocument/didChange", "params": params})
+
+    def test_requests(self):
+        self.server.handle({"id": 1, "method": "initialize", "params": {}})
+        self.server.handle({"id": 2, "method": "textDocument/hover", "params": {}})
+        self.server.handle({"id": 3, "method": "shutdown"})
+        initialize, hover, shutdown = self.messages()
+        sync = initialize["result"]["capabilities"]["textDocumentSync"]
+        self.assertEqual(sync["change"], check_docstrings_lsp.SYNC_INCREMENTAL)
+        self.assertEqual(hover["error"]["code"], check_docstrings_lsp.METHOD_NOT_FOUND)
+        self.assertEqual(shutdown, {"jsonrpc": "2.0", "id": 3, "result": None})
+        self.assertIsNone(self.server.exit_code)
+        self.server.handle({"method": "exit"})
+        self.assertEqual(self.server.exit_code, 0)
+
+    def test_diagnostics_follow_edits(self):
+        self.open(MISMATCH_FILE)
+        (diagnostics,) = self.diagnostics()
+        self.assertEqual(len(diagnostics), 1)
+        self.assertEqual(diagnostics[0]["code"], "type-hint-mismatch")
+        self.assertEqual(diagnostics[0]["range"]["start"], {"line": 0, "character": 0})
+        # Fix the docstring: "       a (str): Integer."
+        self.change(5, 10, 13, "int")
+        self.assertEqual(self.diagnostics(), [[]])
+        # Edits that leave the diagnostics unchanged aren't published
+        self.change(2, 3, 6, "The")
+        self.assertEqual(self.diagnostics(), [])
+
+    def test_only_edited_functions_are_checked(self):
+        self.open(WORKING_FILE + "\n" + MISMATCH_FILE)
+        (diagnostics,) = self.diagnostics()
+        self.assertEqual(diagnostics[0]["range"]["start"]["line"], 9)
+        self.assertEqual(self.server.checked, 2)
+        # Adding lines above moves the findings without checking them again
+        self.change(0, 0, 0, "import os\n\n")
+        (diagnostics,) = self.diagnostics()
+        self.assertEqual(diagnostics[0]["range"]["start"]["line"], 11)
+        self.assertEqual(self.server.checked, 2)
+        self.change(4, 4, 7, "Whole")
+        self.assertEqual(self.server.checked, 3)
+
+    def test_syntax_error_keeps_diagnostics(self):
+        self.open(MISMATCH_FILE)
+        self.messages()
+        self.change(0, 0, 0, "def (")
+        self.assertEqual(self.diagnostics(), [])
+
+    def test_close_clears_diagnostics(self):
+        self.open(MISMATCH_FILE)
+        self.messages()
+        params = {"textDocument": {"uri": self.uri}}
+        self.server.handle({"method": "textDocument/didClose", "params": params})
+        self.assertEqual(self.diagnostics(), [[]])
+        self.assertEqual(self.server.documents, {})
+
+    def test_position_index(self):
+        text = "a\U0001f600b\nc"
+        for line, character, index in [
+            (0, 0, 0),
+            (0, 1, 1),
+            (0, 3, 2),
+            (0, 9, 3),
+            (1, 0, 4),
+            (5, 0, 5),
+        ]:
+            position = {"line": line, "character": character}
+            with self.subTest(position=position):
+                self.assertEqual(
+                    check_docstrings_lsp.position_index(text, position), index
+                )
+
+
+class TestProfile(FilesTestCase):
+    """Test the --profile report."""
+
+    def test_profile_report(self):
+        paths = self.write_files([WORKING_FILE, MISMATCH_FILE])
+        dump = os.path.join(self.tmpdir.name, "profile.out")
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            code, output = self.run_main(["--no-cache", "--profile-dump", dump, *paths])
+        self.assertEqual(code, 1)
+        self.assertIn("Type hint mismatch", output)
+        report = errors.getvalue()
+        for phase in ("read", "extract", "parse args", "parse docstring", "compare"):
+            self.assertRegex(report, rf"\n{phase} +\d")
+        self.assertIn(paths[1], report.split("Slowest files:")[1])
+        self.assertIn(f"{paths[1]}:1 one_mismatch_arg", report)
+        self.assertRegex(report, r"\nparse_google_docstring: \d+ hits, \d+ misses")
+        self.assertGreater(pstats.Stats(dump).total_calls, 0)
+
+    def test_profile_merge(self):
+        profile, other = check_docstrings.Profile(), check_docstrings.Profile()
+        other.TOP = profile.TOP = 2
+        profile.add("read", 1.0, 0.5)
+        other.add("read", 2.0, 1.0)
+        for seconds in (3, 1, 2):
+            other.add_slowest(other.files, (seconds, f"file{seconds}.py"))
+        profile.merge(other)
+        self.assertEqual(profile.phases, {"read": [3.0, 1.5]})
+        self.assertEqual(sorted(profile.files), [(2, "file2.py"), (3, "file3.py")])
+
+
+class TestPrefilter(FilesTestCase):
+    """Test skipping files that can't have findings without checking them."""
+
+    def test_may_have_findings(self):
+        may_have_findings = check_docstrings.may_have_findings
+        self.assertTrue(may_have_findings(WORKING_FILE.encode(), "scan"))
+        self.assertFalse(may_have_findings(b"X = 1\n", "scan"))
+        self.assertFalse(may_have_findings(b'"""Module."""\ndef f(a): pass\n', "regex"))
+        self.assertFalse(may_have_findings(b"def f(a):\n    return a\n", "scan"))
+        self.assertTrue(may_have_findings(b"def f(a):\n    return a\n", "ast"))
+
+    def test_skipped_files_are_not_checked(self):
+        paths = self.write_files(
+            ["X = 1\n", "def f(a):\n    return a\n", MISMATCH_FILE, "x = 'not.py"]
+        )
+        expected = self.run_main(["--no-cache", *paths])
+        errors = io.StringIO()
+        with mock.patch.object(
+            check_docstrings, "check_code", wraps=check_docstrings.check_code
+        ) as check_code, contextlib.redirect_stderr(errors):
+            argv = ["--no-cache", "--profile", "-j1", *paths]
+            self.assertEqual(self.run_main(argv), expected)
+        self.assertEqual(check_code.call_count, 1)
+        self.assertIn("Prefilter skipped 3 of 4 files", errors.getvalue())
+        self.assertIn("Estimated time saved", errors.getvalue())
+        # The AST engine finds syntax errors, so checks every file
+        code, output = self.run_main(["--no-cache", "--engine", "ast", *paths])
+        self.assertIn(f"{paths[3]}:1: Could not parse file", output)
+
+
+class TestMemoryMapped(FilesTestCase):
+    """Test checking large files memory-mapped, as bytes."""
+
+    def test_same_findings_as_reading(self):
+        paths = self.write_files(
+            [MISMATCH_FILE, MISMATCH_FILE.replace("\n", "\r\n"), "", WORKING_FILE]
+        )
+        cache_dir = os.path.join(self.tmpdir.name, "cache")
+        expected = self.run_main(["-v", "--no-cache", *paths])
+        with mock.patch.object(check_docstrings, "MMAP_MIN_SIZE", 0), mock.patch.object(
+            check_docstrings.mmap, "mmap", wraps=check_docstrings.mmap.mmap
+        ) as mapped:
+            cached = ["--cache-dir", cache_dir]
+            for argv in (["--no-cache"], cached, cached):
+                self.assertEqual(self.run_main(["-v", *argv, *paths]), expected)
+            self.assertEqual(self.run_main(["--engine", "ast", *paths])[0], 1)
+        self.assertEqual(mapped.call_count, 3 * 3)
+
+    def test_same_decode_errors_as_reading(self):
+        accented = MISMATCH_FILE.replace("Integer", "Entier \xe9")
+        contents = {
+            "comment.py": b"# caf\xe9\n" + MISMATCH_FILE.encode("utf-8"),
+            "function.py": accented.encode("latin-1"),
+            "valid.py": accented.encode("utf-8"),
+        }
+        paths = []
+        for name, content in contents.items():
+            paths.append(os.path.join(self.tmpdir.name, name))
+            with open(paths[-1], "wb") as f:
+                f.write(content)
+        expected = self.run_main(["--no-cache", *paths])
+        self.assertEqual(expected[1].count("Could not decode file as UTF-8"), 2)
+        # Chunks of one byte split every multi-byte character
+        with mock.patch.object(check_docstrings, "MMAP_MIN_SIZE", 0), mock.patch.object(
+            check_docstrings, "UTF8_CHECK_CHUNK", 1
+        ):
+            self.assertEqual(self.run_main(["--no-cache", *paths]), expected)
+
+
+class TestDiscovery(FilesTestCase):
+    """Test finding files to check in directories."""
+
+    def make_tree(self, files):
+        """Create files, given as relative paths and contents, in the temp directory."""
+        for relative, content in files.items():
+            path = os.path.join(self.tmpdir.name, *relative.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+
+    def walk(self, *args, root=""):
+        root = os.path.join(self.tmpdir.name, root)
+        paths = check_docstrings.walk_python_files(root, *args)
+        return [os.path.relpath(path, root).replace(os.sep, "/") for path in paths]
+
+    def test_walk(self):
+        self.make_tree(
+            {
+                ".gitignore": "build/\n*_pb2.py\n!keep_pb2.py\n/top.py\n",
+                "b.py": "",
+                "a.py": "",
+                "notes.txt": "",
+                "top.py": "",
+                "pkg/top.py": "",
+                "pkg/api_pb2.py": "",
+                "pkg/keep_pb2.py": "",
+                "pkg/.gitignore": "generated_*.py\n",
+                "pkg/generated_x.py": "",
+                "pkg/vendor/lib.py": "",
+                "build/out.py": "",
+                ".git/hooks/hook.py": "",
+            }
+        )
+        self.assertEqual(
+            self.walk(),
+            ["a.py", "b.py", "pkg/keep_pb2.py", "pkg/top.py", "pkg/vendor/lib.py"],
+        )
+        self.assertEqual(
+            self.walk(["*.py", "*.txt"], ["pkg/vendor", "b.py", ".git"]),
+            ["a.py", "notes.txt", "pkg/keep_pb2.py", "pkg/top.py"],
+        )
+        self.assertIn("build/out.py", self.walk(["*.py"], [".git"], False))
+
+    def test_gitignore_above_root(self):
+        self.make_tree(
+            {
+                ".git/HEAD": "",
+                ".gitignore": "src/generated/\n",
+                "src/a.py": "",
+                "src/generated/b.py": "",
+            }
+        )
+        self.assertEqual(self.walk(root="src"), ["a.py"])
+
+    def test_gitignore_patterns(self):
+        translate = check_docstrings.translate_gitignore_pattern
+        cases = [
+            ("*.py", "a/b.py", True),
+            ("/b.py", "a/b.py", False),
+            ("docs/**/gen", "docs/x/y/gen", True),
+            ("docs/**/gen", "docs/gen", True),
+            ("a/**", "a/b/c", True),
+            ("f[!0-9].py", "f1.py", False),
+            ("f?.py", "fx.py", True),
+        ]
+        for pattern, path, matches in cases:
+            with self.subTest(pattern=pattern, path=path):
+                self.assertEqual(bool(re.fullmatch(translate(pattern), path)), matches)
+
+    def test_main_with_directory(self):
+        self.make_tree({"pkg/good.py": WORKING_FILE, "pkg/sub/bad.py": MISMATCH_FILE})
+        pkg = os.path.join(self.tmpdir.name, "pkg")
+        good = os.path.join(pkg, "good.py")
+        for jobs in ("1", "2"):
+            argv = ["--verbose", "--no-cache", "--jobs", jobs, pkg, good]
+            code, output = self.run_main(argv)
+            self.assertEqual(code, 1)
+            self.assertEqual(output.count("Checking docstring"), 2)
+            self.assertIn(os.path.join(pkg, "sub", "bad.py") + ":1: Type hint", output)
+
+
+class TestResultCache(FilesTestCase):
+    """Test the on-disk result cache."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(self.tmpdir.name, "cache")
+
+    def run_cached(self, paths):
+        return self.run_main(["--jobs", "1", "--cache-dir", self.cache_dir, *paths])
+
+    def test_warm_run_skips_checking(self):
+        paths = self.write_files([WORKING_FILE, MISMATCH_FILE])
+        cold = self.run_cached(paths)
+        self.assertEqual(cold[0], 1)
+        with mock.patch.object(check_docstrings, "check_code") as check_code:
+            warm = self.run_cached(paths)
+        check_code.assert_not_called()
+        self.assertEqual(warm, cold)
+
+    def test_changed_file_is_rechecked(self):
+        (path,) = self.write_files([MISMATCH_FILE])
+        self.assertEqual(self.run_cached([path])[0], 1)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(WORKING_FILE)
+        self.assertEqual(self.run_cached([path])[0], 0)
+
+    def test_default_cache_dir_is_per_user(self):
+        (path,) = self.write_files([WORKING_FILE])
+        self.run_main([path])
+        cache_home = os.environ["XDG_CACHE_HOME"]
+        database = os.path.join(cache_home, "check_docstrings", "cache.sqlite3")
+        self.assertTrue(os.path.exists(database))
+
+    def test_no_cache(self):
+        (path,) = self.write_files([WORKING_FILE])
+        self.run_main(["--no-cache", "--cache-dir", self.cache_dir, path])
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    @mock.patch.object(check_docstrings, "RACY_NANOSECONDS", 0)
+    def test_unchanged_stat_skips_reading(self):
+        (path,) = self.write_files([MISMATCH_FILE])
+        cold = self.run_cached([path])
+        read_source = mock.patch.object(
+            check_docstrings, "read_source", wraps=check_docstrings.read_source
+        )
+        with read_source as read:
+            self.assertEqual(self.run_cached([path]), cold)
+        read.assert_not_called()
+
+        # Fix the file without changing its size or mtime, so only hashing notices
+        stat = os.stat(path)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(MISMATCH_FILE.replace("(str)", "(int)"))
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(self.run_cached([path]), cold)
+        self.assertEqual(self.run_cached(["--paranoid", path]), (0, ""))
+
+    @mock.patch.object(check_docstrings, "RACY_NANOSECONDS", 0)
+    def test_stat_index_shares_results_and_is_pruned(self):
+        paths = self.write_files([WORKING_FILE] * 4)
+        self.run_cached(paths)
+        cache = check_docstrings.ResultCache(self.cache_dir)
+        stats = cache.stats()
+        self.assertEqual(stats["indexed files"], 4)
+        # One result per file content, and one for the files without findings
+        self.assertEqual(stats["entries"], 5)
+        cache.close()
+        self.run_main(
+            ["cache", "prune", "--max-size", "0", "--cache-dir", self.cache_dir]
+        )
+        cache = check_docstrings.ResultCache(self.cache_dir)
+        self.assertEqual(cache.stats()["indexed files"], 0)
+        cache.close()
+
+    @mock.patch.object(check_docstrings, "RACY_NANOSECONDS", 0)
+    def test_stat_index_reads_rows_of_given_files(self):
+        paths = self.write_files([WORKING_FILE, MISMATCH_FILE, WORKING_FILE])
+        cold = self.run_cached(paths)
+        load = mock.patch.object(
+            check_docstrings.StatIndex,
+            "load",
+            autospec=True,
+            side_effect=check_docstrings.StatIndex.load,
+        )
+        with load as loaded, mock.patch.object(check_docstrings, "check_code") as check:
+            self.assertEqual(self.run_cached(paths[1:2]), (1, cold[1]))
+            loaded.assert_called_once_with(mock.ANY, [paths[1]])
+            loaded.reset_mock()
+            self.run_cached([self.tmpdir.name])
+            loaded.assert_called_once_with(mock.ANY)
+        check.assert_not_called()
+
+    @mock.patch.object(check_docstrings, "RACY_NANOSECONDS", 0)
+    def test_warm_run_saves_timings(self):
+        paths = self.write_files([WORKING_FILE, MISMATCH_FILE, WORKING_FILE])
+        self.run_cached(paths)
+        timings = os.path.join(self.tmpdir.name, "timings.json")
+        self.run_cached(["--save-timings", timings, *paths])
+        with open(timings, encoding="utf8") as f:
+            self.assertEqual(len(json.load(f)), len(paths))
+
+    def test_recently_modified_files_are_read(self):
+        (path,) = self.write_files([MISMATCH_FILE])
+        self.run_cached([path])
+        read_source = mock.patch.object(
+            check_docstrings, "read_source", wraps=check_docstrings.read_source
+        )
+        with read_source as read:
+            self.run_cached([path])
+        read.assert_called_once()
+
+    @mock.patch.object(check_docstrings, "VERDICTS_MIN_SIZE", 0)
+    def test_changed_file_reuses_function_verdicts(self):
+        (path,) = self.write_files([WORKING_FILE + MISMATCH_FILE + WORKING_FILE])
+        self.assertEqual(self.run_cached([path])[0], 1)
+        # Move the mismatch down a line and change the docstring of one function
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n" + WORKING_FILE.replace("Integer", "Number") + MISMATCH_FILE)
+        with mock.patch.object(
+            check_docstrings, "check_function", wraps=check_docstrings.check_function
+        ) as check_function:
+            cached = self.run_cached([path])
+        self.assertEqual(check_function.call_count, 1)
+        self.assertEqual(cached, self.run_main(["--no-cache", path]))
+        self.assertIn(f"{path}:10: Type hint mismatch", cached[1])
+
+    def test_concurrent_runs_share_cache(self):
+        paths = self.write_files([WORKING_FILE, MISMATCH_FILE] * 8)
+        command = [sys.executable, check_docstrings.__file__, "--jobs", "2"]
+        runs = [
+            subprocess.Popen(
+                [*command, "--cache-dir", self.cache_dir, *paths],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            for _ in range(3)
+        ]
+        outputs = {run.communicate()[0] for run in runs}
+        self.assertEqual(len(outputs), 1)
+        self.assertEqual([run.returncode for run in runs], [1, 1, 1])
+        cache = check_docstrings.ResultCache(self.cache_dir)
+        self.assertEqual(cache.stats()["entries"], len(paths))
+        cache.close()
+
+    def test_prune_evicts_least_recently_used(self):
+        cache = check_docstrings.ResultCache(self.cache_dir)
+        for used, key in enumerate(["old", "middle", "new"]):
+            with mock.patch.object(time, "time", return_value=used * 86400):
+                cache.put(key, ("", []))
+        size = cache.stats()["bytes"] // 3
+        self.assertEqual(cache.prune(2 * size), 1)
+        self.assertIsNone(cache.get("old"))
+        # Reading an entry makes it the most recently used
+        with mock.patch.object(time, "time", return_value=3 * 86400):
+            self.assertEqual(cache.get("middle"), ("", []))
+        self.assertEqual(cache.prune(size), 1)
+        self.assertIsNone(cache.get("new"))
+        self.assertIsNotNone(cache.get("middle"))
+        # Evicting reads the total size kept by triggers rather than summing
+        cache.put("middle", ("output", []))
+        ((total,),) = cache.db.execute("SELECT bytes FROM totals")
+        self.assertEqual(total, cache.stats()["bytes"])
+        cache.close()
+
+    def test_cache_subcommand(self):
+        paths = self.write_files([WORKING_FILE, MISMATCH_FILE])
+        self.run_cached(paths)
+        stats = self.run_main(["cache", "stats", "--cache-dir", self.cache_dir])
+        self.assertEqual(stats[0], 0)
+        self.assertRegex(stats[1], r"^2 results taking \d+ bytes")
+        pruned = self.run_main(
+            ["cache", "prune", "--max-size", "0", "--cache-dir", self.cache_dir]
+        )
+        self.assertEqual(pruned[0], 0)
+        self.assertIn("Evicted 2 results", pruned[1])
+        self.assertIn("\n0 results taking 0 bytes", pruned[1])
+
+
 if __name__ == "__main__":
     unittest.main()